@@ -65,6 +65,9 @@ setup(
     extras_require={
         'test': ['pytest', 'tox'],
         'video': ['av'],
+        'compression': ['hdf5plugin'],
+        'fast-hash': ['google-crc32c', 'xxhash'],
+        'fast-diff': ['difflib-rs'],
     },
     entry_points={
         'console_scripts': [
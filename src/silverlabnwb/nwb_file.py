@@ -1,7 +1,12 @@
-import glob
+import contextlib
+import fnmatch
+import functools
 import os
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from types import MappingProxyType
 
 import h5py
 import numpy as np
@@ -9,8 +14,12 @@ import pandas as pd
 import pkg_resources
 import tifffile
 from hdmf.backends.hdf5 import H5DataIO
+from hdmf.common import VectorData, VectorIndex
+from hdmf.data_utils import DataChunkIterator
 from nptdms import TdmsFile
 from pynwb import get_class, load_namespaces, NWBFile, NWBHDF5IO, TimeSeries
+from pynwb.device import Device
+from pynwb.epoch import TimeIntervals
 from pynwb.file import Subject
 from pynwb.image import ImageSeries
 from pynwb.ophys import ImageSegmentation, OpticalChannel, TwoPhotonSeries
@@ -19,7 +28,7 @@ from pytz import timezone
 from . import metadata
 from .header import LabViewHeader, LabViewVersions
 from .imaging import Modes
-from .timings import LabViewTimings231, LabViewTimingsPre2018
+from .timings import LabViewTimings231, LabViewTimingsPre2018, read_roi_dat
 
 try:
     import av
@@ -27,6 +36,99 @@ except ImportError:
     # This dependency is optional
     av = None
 
+try:
+    import hdf5plugin
+except ImportError:
+    # This dependency is optional
+    hdf5plugin = None
+
+# How to compress datasets, if enabled. Bitshuffle+LZ4 is much faster than gzip for our numeric
+# data, both to write and read, but needs the HDF5 plugin; LZF is built in to h5py.
+if hdf5plugin is None:
+    COMPRESSION_SETTINGS = {'compression': 'lzf'}
+else:
+    COMPRESSION_SETTINGS = dict(hdf5plugin.Bitshuffle(), allow_plugin_filters=True)
+
+# Target size in bytes for each chunk of a compressed dataset
+CHUNK_BYTES = 1024**2
+# Datasets smaller than this many bytes are not compressed
+COMPRESS_THRESHOLD = 256 * 1024
+
+# The ROI.dat columns we store, and the names we use for them as identifiers
+ROI_COLUMNS = MappingProxyType({
+    'ROI index': 'roi_index', 'Pixels in ROI': 'num_pixels',
+    'X start': 'x_start', 'Y start': 'y_start', 'Z start': 'z_start',
+    'X stop': 'x_stop', 'Y stop': 'y_stop', 'Z stop': 'z_stop',
+    'Laser Power (%)': 'laser_power', 'ROI Time (ns)': 'roi_time_ns',
+    'Angle (deg)': 'angle_deg', 'Composite ID': 'composite_id',
+    'Number of lines': 'num_lines', 'Frame Size': 'frame_size',
+    'Zoom': 'zoom', 'ROI group ID': 'roi_group_id'
+})
+# Pixel coordinates and counts are integers
+_ROI_INT_FIELDS = frozenset(['x_start', 'x_stop', 'y_start', 'y_stop', 'num_pixels'])
+# Apart from the Z coordinates, the other fields have always been stored at half precision
+_ROI_HALF_PRECISION_FIELDS = tuple(field for field in ROI_COLUMNS.values()
+                                   if field not in _ROI_INT_FIELDS and field not in ('z_start', 'z_stop'))
+
+
+_namespace_loaded = False
+
+
+def _load_silverlab_namespace():
+    """Load our NWB extension namespace, if not already loaded in this process."""
+    global _namespace_loaded
+    if not _namespace_loaded:
+        # assume silverlab extension is in this file's directory
+        load_namespaces(pkg_resources.resource_filename(__name__, "silverlab.namespace.yaml"))
+        _namespace_loaded = True
+
+
+@functools.lru_cache(maxsize=None)
+def _silverlab_class(type_name):
+    """Get the Python class for a type in our NWB extension, looking each up only once."""
+    _load_silverlab_namespace()
+    return get_class(type_name, 'silverlab_extended_schema')
+
+
+def _list_files(folder_path):
+    """Get the sorted names of all the (non-hidden) files in a folder.
+
+    This uses os.scandir, which avoids a separate stat call for each entry.
+    Hidden files are skipped, as glob would do.
+    """
+    with os.scandir(folder_path) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.is_file() and not entry.name.startswith('.'))
+
+
+def _pick_chunks(shape, dtype, target_bytes=CHUNK_BYTES, row_multiple=1):
+    """Choose a chunk shape of roughly target_bytes for a dataset.
+
+    Our timeseries are read in slices along the first (time) axis, so chunks always
+    span the full extent of the other dimensions, e.g. whole image frames.
+
+    If the data are written in blocks of row_multiple rows (e.g. one trial at a time),
+    chunk boundaries are aligned with the blocks, so that no write covers part of a
+    chunk: a chunk holds either a whole number of blocks or an exact fraction of one.
+
+    :param shape: the shape of the full dataset
+    :param dtype: the type of the data elements
+    :param target_bytes: the desired size of each chunk
+    :param row_multiple: the number of rows written at once
+    :returns: the chunk shape, or None to let h5py decide if the dataset is empty
+    """
+    shape = tuple(int(dim) for dim in shape)
+    if not shape or 0 in shape:
+        return None
+    row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+    rows = max(1, target_bytes // row_bytes)
+    if rows >= row_multiple:
+        rows -= rows % row_multiple
+    else:
+        # Use the largest fraction of a block that fits in the target size
+        rows = max(d for d in range(1, rows + 1) if row_multiple % d == 0)
+    return (min(rows, shape[0]),) + shape[1:]
+
 
 class NwbFile():
     """Silver Lab wrapper for the NWB data format.data
@@ -40,6 +142,9 @@ class NwbFile():
     However, there is also an explicit close() method, and this will be called
     when the object is deleted.
 
+    Each method saves its changes to disk before returning. import_labview_folder
+    and create_from_metadata save once, when all their steps are done.
+
     Once a file has been opened, two main access mechanisms are provided:
     - nwb.nwb_file - the NWB API interface to the file
     - nwb.hdf_file - the h5py interface to the file
@@ -63,19 +168,22 @@ class NwbFile():
         :param verbose: if True, print status information as processing happens
         """
         self.verbose = verbose
-        self.nwb_file = None
+        self.nwb_file = None  # Also clears the _nwb_file_stale flag
+        self._hdf_file = None
         self.nwb_path = nwb_path
         assert mode in {'r', 'r+', 'w', 'w-', 'a'}
         self.nwb_open_mode = mode
         if mode in {'r', 'r+'} or (mode == 'a' and os.path.isfile(nwb_path)):
             self.open_nwb_file()
-        # assume silverlab extension is in this file's directory
-        load_namespaces(pkg_resources.resource_filename(__name__, "silverlab.namespace.yaml"))
+        _load_silverlab_namespace()
         self.custom_silverlab_dict = dict()
         self.labview_version = None
         self.imaging_info = None
         self.trial_times = None
         self.compress = None
+        self._times_cache = {}  # timestamps for each timeseries, by object ID
+        self._dirty = False  # Whether there are changes not yet written to disk
+        self._batching = False  # Whether saving changes is deferred (see _batch_writes)
 
     def import_labview_folder(self, folder_path, compress=True):
         """Import all data from a Labview export folder into this NWB file.
@@ -94,9 +202,15 @@ class NwbFile():
         session_id = folder_name.split(' ')[0]  # Drop the ' FunctAcq' part
         self.log('Importing Labview session', session_id, 'from', folder_path)
         self.compress = compress
-        speed_data, expt_start_time = self.create_nwb_file(folder_path, session_id)
-        self.add_core_metadata()
-        self.import_labview_data(folder_path, folder_name, speed_data, expt_start_time)
+        # Save the file once at the end, rather than after every step
+        with self._batch_writes():
+            speed_data, expt_start_time = self.create_nwb_file(folder_path, session_id)
+            self.add_core_metadata()
+            self.add_speed_data(speed_data, expt_start_time)
+            # We don't need the speed data table any more, so free up its memory before
+            # reading the much larger imaging data
+            del speed_data
+            self.import_labview_data(folder_path, folder_name)
         self.log('All data imported')
 
     def create_from_metadata(self, metadata_file, user=None):
@@ -131,18 +245,63 @@ class NwbFile():
             'identifier': f"{os.path.basename(metadata_file)}; {datetime.now()}",
             'session_description': self.session_description,
         }
-        self.nwb_file = NWBFile(**nwb_settings)
-        self.add_core_metadata()
-        self.add_custom_silverlab_data(include_opto=False)
+        self.nwb_file = NWBFile(**nwb_settings, **self._gather_core_metadata())
+        with self._batch_writes():
+            self.add_core_metadata()
+            self.add_custom_silverlab_data(include_opto=False)
         self.log('All metadata added')
 
+    @property
+    def nwb_file(self):
+        """The in-memory NWB file object.
+
+        If the file on disk has been modified directly (see _write_roi_data), it is
+        only read back in when next needed.
+        """
+        if self._nwb_file_stale:
+            self.open_nwb_file()
+        return self._nwb_file
+
+    @nwb_file.setter
+    def nwb_file(self, nwb_file):
+        self._nwb_file = nwb_file
+        self._nwb_file_stale = False
+
     @property
     def hdf_file(self):
-        """Access the h5py interface to this NWB file."""
-        assert self.nwb_file is not None
-        # TODO Should we check if the file is still open? Or perhaps
-        # turn this into a real field?
-        return h5py.File(self.nwb_path, self.nwb_open_mode)
+        """Access the h5py interface to this NWB file.
+
+        The file is opened on first access and the handle kept for later calls,
+        until the file is closed or rewritten by the NWB API.
+        """
+        assert self._nwb_file is not None or self._nwb_file_stale
+        if self._hdf_file is None or not self._hdf_file.id.valid:
+            if self.nwb_open_mode == 'r':
+                self._hdf_file = self._open_hdf_file_for_reading()
+            else:
+                # The file exists by now, so opening for writing must not truncate it
+                self._hdf_file = h5py.File(self.nwb_path, 'a')
+        return self._hdf_file
+
+    def _open_hdf_file_for_reading(self):
+        """Open the file read-only with h5py, with settings suited to lots of reads.
+
+        SWMR mode gives faster metadata access, but is only possible if the file was
+        written with the latest HDF5 file format, so we fall back to a normal open.
+        The chunk cache is left at h5py's defaults, as its settings apply to each
+        dataset opened, not to the file as a whole.
+        """
+        try:
+            return h5py.File(self.nwb_path, 'r', libver='latest', swmr=True)
+        except (OSError, ValueError):
+            return h5py.File(self.nwb_path, 'r')
+
+    def _close_hdf_file(self):
+        """Close our h5py handle on the file, if open, so the NWB API can write to it."""
+        if self._hdf_file is not None:
+            if self._hdf_file.id.valid:
+                self._hdf_file.close()
+            self._hdf_file = None
 
     def __getitem__(self, name):
         """Provide access to nodes within this file just like h5py does.
@@ -154,6 +313,10 @@ class NwbFile():
     def open_nwb_file(self):
         """Open an existing NWB file for reading and optionally modification.
 
+        Note that if the file is opened read-only, the h5py interface (hdf_file) uses
+        SWMR mode where possible, which requires the file to use the latest HDF5 format
+        (libver='latest'); other files are opened normally.
+
         TODO: If allowing modification then the copy_append setting defaults to True and
         we can't modify it via nwb_file.open - we'd need to call the underlying routines
         directly if we want to avoid copying the original file! However, this copying
@@ -195,35 +358,51 @@ class NwbFile():
             'session_description': self.session_description,
             'session_id': session_id,
         }
-        self.nwb_file = NWBFile(**nwb_settings)
+        self.nwb_file = NWBFile(**nwb_settings, **self._gather_core_metadata())
         # TODO Incorporate extensions according to new API
         self.add_labview_header(header_fields)
-        # Write the new NWB file
-        self._write()
+        self._changed()
         return speed_data, expt_start_time
 
     def add_core_metadata(self):
         """Add core metadata from the YAML config file to the NWB file.
 
-        This fills in many of the fields in /general.
+        This fills in many of the fields in /general. Normally these are given when the
+        NWB file is created (see _gather_core_metadata), so only those fields not yet
+        set are filled in here, along with the devices.
         """
-        self.add_general_info('experimenter', self.user['name'])  # TODO: Add ORCID etc.
-        self.add_general_info('experiment_description', self.experiment['description'])
-        self.add_general_info('institution', 'University College London')
-        self.add_general_info('lab', 'Silver Lab (http://silverlab.org)')
+        for label, value in self._gather_core_metadata().items():
+            if getattr(self.nwb_file, label, None) is None:
+                self.add_general_info(label, value)
         self.add_devices_info()
+        self._changed()
+
+    def _gather_core_metadata(self):
+        """Collect core metadata from the YAML config file, for the fields in /general.
+
+        Setting these one at a time on an existing NWB file is slow, so this gives
+        them as a dictionary which can be passed to the NWBFile constructor. Fields
+        that are not specified are omitted, so that pynwb defaults will be used.
+        """
+        general = {
+            'experimenter': self.user['name'],  # TODO: Add ORCID etc.
+            'experiment_description': self.experiment['description'],
+            'institution': 'University College London',
+            'lab': 'Silver Lab (http://silverlab.org)',
+            'devices': self._make_devices(),
+        }
         for field in ['data_collection', 'pharmacology', 'protocol', 'slices',
                       'surgery', 'virus', 'related_publications', 'notes']:
             if field in self.experiment:
-                self.add_general_info(field, self.experiment[field])
+                general[field] = self.experiment[field]
         # Stimulus information is now accessed as `stimulus_notes` in the API,
         # even though it is still stored under /general/stimulus
         if 'stimulus' in self.experiment:
-            self.add_general_info('stimulus_notes', self.experiment['stimulus'])
+            general['stimulus_notes'] = self.experiment['stimulus']
         if 'subject' in self.experiment:
-            self.add_subject(self.experiment['subject'])
-        # Update the file on disk:
-        self._write()
+            subject_data = self.experiment['subject']
+            general['subject'] = Subject(**{key: value for key, value in subject_data.items() if value is not None})
+        return {label: value for label, value in general.items() if value is not None}
 
     def add_subject(self, subject_data):
         """Add the valid subject information from YAML config to the NWB file.
@@ -234,20 +413,21 @@ class NwbFile():
         subject = Subject(**valid_subject_data)
         self.add_general_info('subject', subject)
 
-    def import_labview_data(self, folder_path, folder_name, speed_data, expt_start_time):
+    def import_labview_data(self, folder_path, folder_name, speed_data=None, expt_start_time=None):
         """Import the bulk of the Labview data to NWB.
 
         :param folder_path: the Labview folder to import
         :param folder_name: the name of the Labview folder
-        :param speed_data: mouse speed data
-        :param expt_start_time: when the experiment started
+        :param speed_data: mouse speed data, if not already added with add_speed_data
+        :param expt_start_time: when the experiment started, if speed_data is given
         """
 
         def rel(file_name):
             """Return the path of a file name relative to the Labview folder."""
             return os.path.join(folder_path, file_name)
 
-        self.add_speed_data(speed_data, expt_start_time)
+        if speed_data is not None:
+            self.add_speed_data(speed_data, expt_start_time)
         self.determine_trial_times()
         self.add_stimulus()
         self.read_cycle_relative_times(folder_path)
@@ -264,7 +444,12 @@ class NwbFile():
         return self
 
     def __exit__(self, type, value, traceback):
-        """Close the NWB file when the context is exited."""
+        """Close the NWB file when the context is exited.
+
+        Any pending changes are written out first, unless an exception occurred.
+        """
+        if type is None:
+            self.flush()
         self.close()
 
     def __del__(self):
@@ -273,6 +458,7 @@ class NwbFile():
 
     def close(self):
         """Close our NWB file. Note that any unwritten changes will be lost."""
+        self._close_hdf_file()
         self.nwb_file = None
 
     def log(self, msg_template, *args, **kwargs):
@@ -320,18 +506,21 @@ class NwbFile():
         """Populate /general/devices with information about the rig.
 
         The names and descriptions of devices are taken from the metadata config file.
+        Normally the devices are given when the NWB file is created, so this only adds
+        any that are missing.
+        """
+        for device in self._make_devices():
+            if device.name not in self.nwb_file.devices:
+                self.nwb_file.add_device(device)
+
+    def _make_devices(self):
+        """Create the devices making up the rig, as listed in the metadata config file.
+
+        Cameras are not included, since these are only added if there is video data.
         """
-        for device_name, desc in self.user_metadata['devices'].items():
-            if not device_name.endswith('Cam'):
-                # Calling create_device immediately adds the new device to the
-                # NWB file
-                # HACK We're adding the description where the source should go,
-                # since the "help" attribute (which seems a better fit for it)
-                # will not retain any overwritten value in the written-out file.
-                # Oddly, this still works even after the "source" attribute was
-                # removed from the API (although the description is not written
-                # out to file).
-                self.nwb_file.create_device(device_name, desc)
+        return [Device(name=device_name, description=desc)
+                for device_name, desc in self.user_metadata['devices'].items()
+                if not device_name.endswith('Cam')]
 
     def parse_experiment_header_ini(self, filename):
         """Read the LabView .ini file and store fields for later processing.
@@ -403,27 +592,45 @@ class NwbFile():
         self.add_general_info("labview_header", fields)  # TODO use the extension
 
     def add_time_series_data(self, label, data, times, ts_attrs={}, data_attrs={},
-                             kind=TimeSeries):
+                             kind=TimeSeries, rows_per_write=1):
         """Create a basic acquisition timeseries and add to the NWB file.
 
         :param label: Name of the group within /acquisition/timeseries.
         :param data: The data array.
-        :param times: The timestamps array.
+        :param times: The timestamps array, or another timeseries whose timestamps to link to.
         :param ts_attrs: Any attributes for the timeseries group itself.
         :param data_attrs: Any attributes for the data array.
         :param kind: The class of timeseries to create, e.g. TwoPhotonSeries.
+        :param rows_per_write: For data filled in later, how many samples will be written
+        at a time. Chunks are aligned to match.
         :param compress: True if data should be compressed, False otherwise
         :returns: The new timeseries group.
         """
         all_attrs = dict(ts_attrs)
         all_attrs.update(data_attrs)
-        if self.compress and data is not None:
-            wrapped_data = H5DataIO(data=data,
-                                    compression='gzip',
-                                    compression_opts=4,
-                                    )
-        else:
-            wrapped_data = data
+        io_settings = {}
+        if isinstance(data, DataChunkIterator):
+            # An empty iterator reserves space for data to be filled in later (see
+            # read_functional_data). Nothing is written for it, and until it is
+            # filled in HDF5 returns the fill value.
+            shape, dtype = data.maxshape, data.dtype
+            io_settings['fillvalue'] = 0
+        elif data is not None:
+            data = np.asarray(data)
+            shape, dtype = data.shape, data.dtype
+        # Small datasets are stored uncompressed, as chunking costs more than it saves
+        if (self.compress and data is not None
+                and np.dtype(dtype).itemsize * int(np.prod(shape)) >= COMPRESS_THRESHOLD):
+            io_settings.update(COMPRESSION_SETTINGS)
+            if hdf5plugin is None and np.dtype(dtype).itemsize > 1:
+                # Bitshuffle does this itself, but LZF benefits from shuffling any multi-byte
+                # values, including the integer-valued floats of the ROI data
+                io_settings['shuffle'] = True
+            io_settings['chunks'] = _pick_chunks(shape, dtype, row_multiple=rows_per_write)
+        elif isinstance(data, DataChunkIterator):
+            # HDF5 will chunk this anyway, so make sure the chunks suit how we fill it in
+            io_settings['chunks'] = _pick_chunks(shape, dtype, row_multiple=rows_per_write)
+        wrapped_data = H5DataIO(data=data, **io_settings) if io_settings else data
         ts = kind(name=label, data=wrapped_data, timestamps=times, **all_attrs)
         return self.nwb_file.add_acquisition(ts)
 
@@ -431,7 +638,7 @@ class NwbFile():
         """Read acquired speed data from the raw data file.
 
         The columns in the file are:
-         - Date as MM/DD/YYYY
+         - Date as DD/MM/YYYY
          - Time at HH:MM:SS.UUUUUU
          - Microseconds since start of trial
          - Speed in rpm (1 rpm = 50 cm/s), always negative!
@@ -448,12 +655,16 @@ class NwbFile():
         """
         self.log('Loading speed data from {}', file_name)
         assert os.path.isfile(file_name)
-        speed_data = pd.read_csv(file_name, sep='\t', header=None, usecols=[0, 1, 2, 3], index_col=0,
+        speed_data = pd.read_csv(file_name, sep='\t', header=None, usecols=[0, 1, 2, 3],
                                  names=('Date', 'Time', 'Trial time', 'Speed'),
-                                 dtype={'Trial time': np.int32, 'Speed': np.float32},
-                                 parse_dates=[[0, 1]],  # Combine first two cols
-                                 dayfirst=True, infer_datetime_format=True,
+                                 dtype={'Date': str, 'Time': str, 'Trial time': np.int32, 'Speed': np.float32},
                                  memory_map=True)
+        # Combine the first two columns into a time index. Parsing them all in one go with an
+        # explicit format is much faster than having pandas infer the format while reading.
+        speed_data.index = pd.to_datetime(speed_data['Date'] + ' ' + speed_data['Time'],
+                                          format='%d/%m/%Y %H:%M:%S.%f')
+        speed_data.index.name = 'Date_Time'
+        speed_data.drop(['Date', 'Time'], axis=1, inplace=True)
         initial_offset = pd.Timedelta(microseconds=speed_data['Trial time'][0])
         initial_time = speed_data.index[0] - initial_offset
         return speed_data, initial_time
@@ -476,9 +687,12 @@ class NwbFile():
         self.add_time_series_data('speed_data', speed_data['Speed'].values, rel_times,
                                   ts_attrs=ts_attrs, data_attrs=speed_attrs)
         ts_attrs['description'] = 'Per-trial times for mouse speed data.'
-        self.add_time_series_data('trial_times', speed_data['Trial time'].values, rel_times,
+        # Both series have the same timestamps, so we link to the first rather than
+        # storing them twice
+        self.add_time_series_data('trial_times', speed_data['Trial time'].values,
+                                  self.nwb_file.get_acquisition('speed_data'),
                                   ts_attrs=ts_attrs, data_attrs=time_attrs)
-        self._write()
+        self._changed()
 
     def get_times(self, timeseries):
         """Get the timestamps for a timeseries as a numpy array.
@@ -486,15 +700,25 @@ class NwbFile():
         Will handle both the case where there is a 'timestamps' attribute, and the case where
         these must be determined from 'starting_time' and rate.
 
+        The result is cached, so repeated calls for the same timeseries are cheap.
+
         :param timeseries: the timeseries
         """
-        if timeseries.timestamps is not None:
-            t = np.array(timeseries.timestamps)
+        if timeseries.object_id in self._times_cache:
+            return self._times_cache[timeseries.object_id]
+        timestamps = timeseries.timestamps
+        if isinstance(timestamps, h5py.Dataset):
+            # Read straight into a new array, avoiding h5py's general slicing machinery
+            t = np.empty(timestamps.shape, dtype=timestamps.dtype)
+            timestamps.read_direct(t)
+        elif timestamps is not None:
+            t = np.asarray(timestamps)
         else:
             n = timeseries.num_samples
             t0 = timeseries.starting_time
             rate = timeseries.rate
             t = t0 + np.arange(n) / rate
+        self._times_cache[timeseries.object_id] = t
         return t
 
     def determine_trial_times(self):
@@ -513,12 +737,26 @@ class NwbFile():
         if self.labview_version is LabViewVersions.pre2018:
             self.log('Calculating trial times from speed data')
             trial_times_ts = self.nwb_file.get_acquisition('trial_times')
-            trial_times = np.array(trial_times_ts.data)
-            # Prepend -1 so we pick up the first trial start
-            # Append -1 in case there isn't a reset recorded at the end of the last trial
-            deltas = np.ediff1d(trial_times, to_begin=-1, to_end=-1)
-            # Find resets and pair these up to mark start & end points
-            reset_idxs = (deltas < 0).nonzero()[0].copy()
+            trial_times = trial_times_ts.data
+            if isinstance(trial_times, H5DataIO):
+                # When compressing, the data we added is still wrapped with its storage settings
+                trial_times = trial_times.data
+            # Find resets, working through the data a block at a time so that we never
+            # need to hold a copy of it all in memory
+            block_size = 2**20
+            resets = []
+            previous = None
+            for start in range(0, len(trial_times), block_size):
+                block = np.asarray(trial_times[start:start + block_size])
+                # Use -1 for the first delta so we pick up the first trial start
+                first_delta = -1 if previous is None else block[0] - previous
+                deltas = np.ediff1d(block, to_begin=first_delta)
+                resets.append(np.flatnonzero(deltas < 0) + start)
+                previous = block[-1]
+            # Add a reset at the end in case there isn't one recorded at the end of the last trial
+            resets.append([len(trial_times)])
+            # Pair the resets up to mark start & end points
+            reset_idxs = np.concatenate(resets)
             assert reset_idxs.ndim == 1
             num_trials = reset_idxs.size // 2  # Drop the extra reset added at the end if
             reset_idxs = np.resize(reset_idxs, (num_trials, 2))  # it's not needed
@@ -531,7 +769,7 @@ class NwbFile():
         elif self.labview_version is LabViewVersions.v231:
             epoch_times = self.trial_times
         # Create the epochs in the NWB file
-        # Note that we cannot pass the actual start time to nwb_file.add_epoch since it
+        # Note that we cannot use the actual start time for each epoch since it
         # would add the last previous junk speed reading to the start of the next trial,
         # since they have exactly the same timestamp. We therefore cheat and pass a time
         # point 1 ns after that time, instead. All equipment records times with >1us
@@ -539,19 +777,43 @@ class NwbFile():
         # maybe better thought of as the time of the last junk speed reading.
         # We also massage the end time since otherwise data points at exactly that time are
         # omitted.
-        self.nwb_file.add_epoch_column('epoch_name', 'the name of the epoch')
-        for i, (start_time, stop_time) in enumerate(epoch_times):
-            assert stop_time > start_time >= 0
-            trial = 'trial_{:04d}'.format(i + 1)
-            self.nwb_file.add_epoch(
-                epoch_name=trial,
-                start_time=start_time if i == 0 else start_time + 1e-9,
-                stop_time=stop_time + 1e-9,
-                timeseries=[speed_data_ts])
-            # We also record exact start & end times in the trial table, since our epochs
-            # correspond to trials.
-            self.nwb_file.add_trial(start_time=start_time, stop_time=stop_time)
-        self._write()
+        # Adding epochs & trials one at a time is slow when there are many trials, so we
+        # compute each column for all trials at once and create the tables directly.
+        epoch_times = np.asarray(epoch_times, dtype=np.float64).reshape(-1, 2)
+        start_times, stop_times = epoch_times[:, 0], epoch_times[:, 1]
+        assert np.all(stop_times > start_times) and np.all(start_times >= 0)
+        num_trials = len(epoch_times)
+        epoch_starts = start_times + 1e-9
+        epoch_starts[:1] = start_times[:1]
+        epoch_stops = stop_times + 1e-9
+        # Each epoch refers to the speed readings within it, found as add_epoch would do
+        speed_times = self.get_times(speed_data_ts)
+        idx_starts = np.searchsorted(speed_times, epoch_starts, side='left')
+        counts = np.searchsorted(speed_times, epoch_stops, side='left') - idx_starts
+        timeseries = VectorData('timeseries', 'index into a TimeSeries object',
+                                data=[(idx_start, count, speed_data_ts)
+                                      for idx_start, count in zip(idx_starts.tolist(), counts.tolist())])
+        self.nwb_file.epochs = TimeIntervals(
+            'epochs', 'experimental epochs', id=list(range(num_trials)),
+            columns=[
+                VectorData('start_time', 'Start time of epoch, in seconds', data=epoch_starts.tolist()),
+                VectorData('stop_time', 'Stop time of epoch, in seconds', data=epoch_stops.tolist()),
+                VectorData('epoch_name', 'the name of the epoch',
+                           data=['trial_{:04d}'.format(i + 1) for i in range(num_trials)]),
+                timeseries,
+                VectorIndex('timeseries_index', list(range(1, num_trials + 1)), target=timeseries),
+            ],
+            colnames=['start_time', 'stop_time', 'epoch_name', 'timeseries'])
+        # We also record exact start & end times in the trial table, since our epochs
+        # correspond to trials.
+        self.nwb_file.trials = TimeIntervals(
+            'trials', 'experimental trials', id=list(range(num_trials)),
+            columns=[
+                VectorData('start_time', 'Start time of epoch, in seconds', data=start_times.tolist()),
+                VectorData('stop_time', 'Stop time of epoch, in seconds', data=stop_times.tolist()),
+            ],
+            colnames=['start_time', 'stop_time'])
+        self._changed()
 
     def add_stimulus(self):
         """Add information about the stimulus presented.
@@ -573,18 +835,12 @@ class NwbFile():
                 'conversion': float('nan'),
                 'resolution': float('nan')
             }
-            # TODO We can maybe build puffs and times a bit more efficiently or
-            # in fewer steps, although it probably won't make a huge difference
-            # (eg we can now get all the times with a single indexing expression)
-            num_epochs = len(self.nwb_file.epochs)
-            puffs = [u'puff'] * num_epochs
-            times = np.zeros((len(puffs),), dtype=np.float64)
-            for i in range(num_epochs):
-                times[i] = self.nwb_file.epochs[i, 'start_time'] + stim['trial_time_offset']
+            # The stimulus occurs at a fixed offset within each trial (epoch)
+            times = np.asarray(self.nwb_file.epochs['start_time'].data, dtype=np.float64) + stim['trial_time_offset']
             attrs['timestamps'] = times
-            attrs['data'] = puffs
+            attrs['data'] = [u'puff'] * len(times)
             self.nwb_file.add_stimulus(TimeSeries(**attrs))
-        self._write()
+        self._changed()
 
     def read_cycle_relative_times(self, folder_path):
         """Read the files containing relative times and store the values in memory.
@@ -657,17 +913,15 @@ class NwbFile():
         self.log('Loading functional data from {}', folder_path)
         assert os.path.isdir(folder_path)
         # Figure out timestamps, measured in seconds
-        epoch_names = self.nwb_file.epochs[:, 'epoch_name']
-        trials = [int(s[6:]) for s in epoch_names]  # names start with 'trial_'
+        # The start times are read just once, straight from the column data, rather
+        # than going through the table's row indexing. There is one epoch per trial.
+        trial_starts = np.asarray(self.nwb_file.epochs['start_time'].data, dtype=np.float64)
+        num_trials = len(trial_starts)
         cycles_per_trial = self.imaging_info.cycles_per_trial
-        num_times = cycles_per_trial * len(epoch_names)
+        num_times = cycles_per_trial * num_trials
         single_trial_times = np.arange(cycles_per_trial) * self.cycle_time
-        times = np.zeros((num_times,), dtype=float)
-        # TODO Perhaps this loop can be vectorised
-        for i in range(len(epoch_names)):
-            trial_start = self.nwb_file.epochs[i, 'start_time']
-            times[i * cycles_per_trial:
-                  (i + 1) * cycles_per_trial] = single_trial_times + trial_start
+        times = (trial_starts[:, np.newaxis] + single_trial_times[np.newaxis, :]).reshape(-1)
+        assert times.shape == (num_times,)
         self.custom_silverlab_dict['cycle_time'] = self.cycle_time
         self.custom_silverlab_dict['cycles_per_trial'] = cycles_per_trial
 
@@ -680,8 +934,8 @@ class NwbFile():
         ts_attrs = {'comments': 'The AOL microscope can acquire just the pixels comprising defined'
                                 ' ROIs. This timeseries records those pixels over time for a'
                                 ' single ROI & channel.'}
-        PixelTimeOffsets = get_class('PixelTimeOffsets', 'silverlab_extended_schema')
-        ROISeriesWithPixelTimeOffsets = get_class('ROISeriesWithPixelTimeOffsets', 'silverlab_extended_schema')
+        PixelTimeOffsets = _silverlab_class('PixelTimeOffsets')
+        ROISeriesWithPixelTimeOffsets = _silverlab_class('ROISeriesWithPixelTimeOffsets')
 
         gains = self.imaging_info.gains
         # Iterate over ROIs, which are nested inside each imaging plane section
@@ -693,17 +947,21 @@ class NwbFile():
             # their index into the table, which does not necessarily correspond
             # to the id (in our case, ids start from 1 and indices from 0). See:
             # https://github.com/NeurodataWithoutBorders/pynwb/issues/673
+            # We index straight into the column's data, rather than going through the table.
+            plane_dimensions = plane['dimensions'].data
             for roi_num, roi_ind in self.roi_mapping[plane_name].items():
                 roi_name = 'ROI_{:03d}'.format(roi_num)
-                if roi_num not in all_rois.keys():
-                    all_rois[roi_num] = {}
+                all_rois.setdefault(roi_num, {})
+                # The data are stored as (time, y, x); dimensions are given as (x, y)
+                roi_dimensions = plane_dimensions[roi_ind]
+                data_shape = (num_times, int(roi_dimensions[1]), int(roi_dimensions[0]))
                 for ch, channel in {'A': 'Red', 'B': 'Green'}.items():
-                    # Set zero data for now; we'll read the real data later
-                    # TODO: The TDMS uses 64 bit floats; we may not really need that precision!
-                    # The exported data seems to be rounded to unsigned ints. Issue #15.
-                    roi_dimensions = plane[roi_ind, 'dimensions']
-                    data_shape = np.concatenate((roi_dimensions, [num_times]))[::-1]
-                    data = np.zeros(data_shape, dtype=np.float64)
+                    # Set zero data for now; we'll read the real data later. We use an empty
+                    # iterator so the dataset gets created at full size (and filled with zeros
+                    # by HDF5) without allocating a buffer for it in memory.
+                    # The TDMS uses 64 bit floats, but the values are rounded to integers (see
+                    # _write_roi_data), which single precision holds exactly up to 2**24. Issue #15.
+                    data = DataChunkIterator(data=None, maxshape=data_shape, dtype=np.dtype(np.float32))
                     # Create the timeseries object and fill in standard metadata
                     ts_name = 'ROI_{:03d}_{}'.format(roi_num, channel)
                     ts_attrs['description'] = ts_desc_template.format(channel=channel.lower(),
@@ -727,7 +985,8 @@ class NwbFile():
                     data_attrs['pixel_time_offsets'] = PixelTimeOffsets(self.raw_pixel_time_offsets[roi_num - 1])
                     self.add_time_series_data(ts_name, data=data, times=times,
                                               kind=ROISeriesWithPixelTimeOffsets,
-                                              ts_attrs=ts_attrs, data_attrs=data_attrs)
+                                              ts_attrs=ts_attrs, data_attrs=data_attrs,
+                                              rows_per_write=cycles_per_trial)
 
                     # Store the path where these data should go in the file
                     all_rois[roi_num][channel] = '/acquisition/{}/data'.format(ts_name)
@@ -749,12 +1008,11 @@ class NwbFile():
         # TODO Are the roi_dimensions always the same across ROIs? (it seems that
         # this was the implication from the previous version of the code, as it
         # always used the last value of roi_dimensions - but that may be a bug?)
-        ch_data_shape = np.concatenate((roi_dimensions,
-                                        [len(all_rois), cycles_per_trial]))[::-1]
-        self._write_roi_data(all_rois, len(trials), cycles_per_trial, ch_data_shape, folder_path)
+        ch_data_shape = (cycles_per_trial, len(all_rois), int(roi_dimensions[1]), int(roi_dimensions[0]))
+        self._write_roi_data(all_rois, num_trials, cycles_per_trial, ch_data_shape, folder_path)
 
     def add_custom_silverlab_data(self, include_opto=True):
-        metadata_class = get_class('SilverLabMetaData', 'silverlab_extended_schema')
+        metadata_class = _silverlab_class('SilverLabMetaData')
         custom_metadata = {
             'name': 'silverlab_metadata',
             'silverlab_api_version': self.SILVERLAB_NWB_VERSION
@@ -765,7 +1023,7 @@ class NwbFile():
         silverlab_metadata = metadata_class(**custom_metadata)
         self.nwb_file.add_lab_meta_data(silverlab_metadata)
         if include_opto:
-            optophysiology_class = get_class('SilverLabOptophysiology', 'silverlab_extended_schema')
+            optophysiology_class = _silverlab_class('SilverLabOptophysiology')
             silverlab_optophysiology = optophysiology_class(
                 name='silverlab_optophysiology',
                 cycle_time=self.custom_silverlab_dict['cycle_time'],
@@ -776,37 +1034,81 @@ class NwbFile():
                 pockels=self.custom_silverlab_dict['zplane_pockels']
             )
             self.nwb_file.add_lab_meta_data(silverlab_optophysiology)
-        self._write()
+        self._changed()
 
     def _write_roi_data(self, all_rois, num_trials, cycles_per_trial,
                         ch_data_shape, folder_path):
-        """Edit the NWB file directly to add the real ROI data."""
-        with h5py.File(self.nwb_path, 'a') as out_file:
-            # Iterate over trials, reading data from the TDMS file for each
+        """Edit the NWB file directly to add the real ROI data.
+
+        Reading the TDMS file for each trial is done on background threads, so
+        that the next trials are being loaded while we write out the current one.
+        Only this thread touches the HDF5 file.
+        """
+        self._close_hdf_file()
+
+        def load_trial(trial_index):
+            """Read and reshape the data for both channels of a single trial.
+
+            :returns: a dict mapping channel name to an array indexed by [roi, time, y, x]
+            """
+            self.log('  Reading TDMS {}', trial_index + 1)
+            file_path = os.path.join(folder_path, '{:03d}.tdms'.format(trial_index + 1))
+            tdms_file = TdmsFile(file_path,
+                                 memmap_dir=tempfile.gettempdir())
+            trial_data = {}
+            for ch, channel in {'0': 'Red', '1': 'Green'}.items():
+                # Reshape the TDMS data into an nd array, with the ROI axis first so each
+                # ROI's data is a contiguous block and the writer does not need to gather slices.
+                raw = tdms_file.channel_data('Functional Imaging Data',
+                                             'Channel {} Data'.format(ch))
+                raw = np.moveaxis(raw.reshape(ch_data_shape), 1, 0)
+                # The round() here is to match the exported data, which also means we can
+                # store it in single precision without losing anything. Rounding, converting
+                # and transposing all happen in a single pass into the output array, so the
+                # (possibly memory-mapped) TDMS data is never copied or modified.
+                ch_data = np.empty(raw.shape, dtype=np.float32)
+                np.rint(raw, out=ch_data, casting='same_kind')
+                trial_data[channel] = ch_data
+            return trial_data
+
+        # How many trials to have loading ahead of the one being written. These load in
+        # parallel, which bounds the memory used while keeping the writer busy.
+        prefetch = 2
+        # The chunk cache settings apply to each dataset, and all the ROI datasets are open
+        # at once. Chunks are aligned with trials (see read_functional_data), so a trial's
+        # write either fills whole chunks or leaves at most one chunk per dataset partly
+        # filled until the next trial. Room for two chunks keeps that chunk in memory
+        # rather than flushing and reading it back. HDF5 evicts fully written chunks first.
+        chunk_shape = _pick_chunks((num_trials * cycles_per_trial,) + tuple(ch_data_shape[2:]),
+                                   np.float32, row_multiple=cycles_per_trial)
+        chunk_bytes = np.dtype(np.float32).itemsize * int(np.prod(chunk_shape)) if chunk_shape else 0
+        h5_settings = dict(rdcc_nbytes=max(2 * chunk_bytes, CHUNK_BYTES))
+        with h5py.File(self.nwb_path, 'a', **h5_settings) as out_file, \
+                ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pending = deque(executor.submit(load_trial, i) for i in range(min(prefetch, num_trials)))
+            # Open each dataset once, rather than looking it up by path for every trial
+            datasets = {(roi_num, channel): out_file[path]
+                        for roi_num, data_paths in all_rois.items()
+                        for channel, path in data_paths.items()}
+            # Iterate over trials, writing the data read from the TDMS file for each
             for trial_index in range(num_trials):
-                self.log('  Reading TDMS {}', trial_index + 1)
-                file_path = os.path.join(folder_path, '{:03d}.tdms'.format(trial_index + 1))
-                tdms_file = TdmsFile(file_path,
-                                     memmap_dir=tempfile.gettempdir())
+                trial_data = pending.popleft().result()
+                if trial_index + prefetch < num_trials:
+                    pending.append(executor.submit(load_trial, trial_index + prefetch))
                 time_segment = slice(trial_index * cycles_per_trial,
                                      (trial_index + 1) * cycles_per_trial)
-                for ch, channel in {'0': 'Red', '1': 'Green'}.items():
-                    # Reshape the TDMS data into an nd array
-                    # TODO: Consider precision: the round() here is to match the exported data...
-                    ch_data = np.round(tdms_file.channel_data('Functional Imaging Data',
-                                                              'Channel {} Data'.format(ch)))
-                    ch_data = ch_data.reshape(ch_data_shape)
-                    # Copy each ROI's data into the NWB
-                    for roi_num, data_paths in all_rois.items():
-                        channel_path = out_file[data_paths[channel]]
-                        channel_path[time_segment, ...] = ch_data[:, roi_num - 1, ...]
-        # Update our reference to the NWB file, since it's now out of sync
-        # We need to keep a reference to the IO object, as the file contents are
-        # not read until needed
-        self.nwb_io = NWBHDF5IO(self.nwb_path, 'r')
-        self.nwb_file = self.nwb_io.read()
-        # Quick fix...
-        self.nwb_io.close()
+                # Copy each ROI's data into the NWB, both channels together
+                # Each ROI's data is already contiguous, so we write it directly,
+                # bypassing the selection machinery used by h5py for general indexing.
+                for roi_num in all_rois:
+                    for channel, ch_data in trial_data.items():
+                        datasets[roi_num, channel].write_direct(ch_data[roi_num - 1],
+                                                                dest_sel=np.s_[time_segment])
+                del trial_data
+        # Our in-memory NWB file is now out of sync, but it is often not used again
+        # (e.g. read_video_data reads the file itself), so only re-read it if needed
+        self._nwb_file = None
+        self._nwb_file_stale = True
 
     def add_imaging_plane(self, name, description, origin_coords, grid_spacing,
                           green=True, red=True):
@@ -870,24 +1172,25 @@ class NwbFile():
         num_pixels = self.imaging_info.frame_size
         plane_width_in_microns = self.imaging_info.field_of_view
         self.zplanes = {}
-        for plane in zplane_data.itertuples():
-            name = 'Zstack{:04d}'.format(plane.Index + 1)
-            self.zplanes[plane.z] = name
-            # TODO: Is it OK to have 2D spacing with 3D coords (allowed by pynwb, but this doesn't mean it's OK)?
-            spacing = plane_width_in_microns / (num_pixels - 1)
-            origin_coords = [0, 0, plane.z]
+        # The spacing is the same for every plane
+        # TODO: Is it OK to have 2D spacing with 3D coords (allowed by pynwb, but this doesn't mean it's OK)?
+        spacing = plane_width_in_microns / (num_pixels - 1)
+        grid_spacing = np.float32([spacing, spacing, 0])
+        for index, z in enumerate(zplane_data['z'].values):
+            name = 'Zstack{:04d}'.format(index + 1)
+            self.zplanes[z] = name
             self.add_imaging_plane(
                 name=name,
                 description='Reference Z stack',
-                origin_coords=origin_coords,
-                grid_spacing=np.float32([spacing, spacing, 0])
+                origin_coords=[0, 0, z],
+                grid_spacing=grid_spacing
             )
-        ZplanePockelsDatasetClass = get_class('ZplanePockelsDataset', 'silverlab_extended_schema')
+        ZplanePockelsDatasetClass = _silverlab_class('ZplanePockelsDataset')
         self.custom_silverlab_dict['zplane_pockels'] = ZplanePockelsDatasetClass(
             columns=zplane_data.columns.tolist(),
             data=zplane_data.values)
         self.custom_silverlab_dict['frame_size'] = [num_pixels, num_pixels]
-        self._write()
+        self._changed()
 
     def read_zstack(self, zstack_folder):
         """Add the reference Z stack images into /acquisition.
@@ -905,21 +1208,42 @@ class NwbFile():
         self.log('Loading reference Z stack from {}', zstack_folder)
         assert os.path.isdir(zstack_folder)
         cycle_rate = 1 / self.cycle_time  # Hz
+        num_pixels = self.imaging_info.frame_size
+        width_in_metres = self.imaging_info.field_of_view / 1e6
         self.zstack = {}
+        # Figure out which images we need to read
+        images = []  # (plane_name, plane, channel, file_path) for each image
         for plane_name, plane in self.nwb_file.imaging_planes.items():
             assert plane_name.startswith('Zstack'), 'Found unexpected plane {}'.format(plane_name)
             self.zstack[plane_name] = {}
             for channel in ('Green', 'Red'):
                 plane_index = plane_name[6:]
-                group_name = 'Zstack_{}_{}'.format(channel, plane_index)
                 file_path = os.path.join(zstack_folder,
                                          channel + 'Channel_' + plane_index + '.tif')
                 if not os.path.isfile(file_path):
                     print('Expected Zstack file "{}" missing; skipping.'.format(file_path))
                     continue
-                img = tifffile.imread(file_path)
-                num_pixels = self.imaging_info.frame_size
-                width_in_metres = self.imaging_info.field_of_view / 1e6
+                images.append((plane_name, plane, channel, file_path))
+        if not images:
+            self._changed()
+            return
+        # All the images have the same size, so we read them straight into a single
+        # preallocated array, rather than allocating each one separately.
+        with tifffile.TiffFile(images[0][3]) as tif:
+            all_imgs = np.empty((len(images),) + tif.pages[0].shape, dtype=tif.pages[0].dtype)
+
+        def read_image(index):
+            # Each file holds a single image, so we only need to parse its first page
+            with tifffile.TiffFile(images[index][3]) as tif:
+                tif.pages[0].asarray(out=all_imgs[index])
+            return all_imgs[index:index + 1]
+
+        # Reading the images is mostly waiting on the disk, so we read them in parallel
+        num_workers = max(1, min(32, (os.cpu_count() or 1) * 4, len(images)))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            imgs = executor.map(read_image, range(len(images)))
+            for (plane_name, plane, channel, _), img in zip(images, imgs):
+                group_name = 'Zstack_{}_{}'.format(channel, plane_name[6:])
                 # Save img to NWB
                 ts_attrs = {'description': 'Initial reference Z stack plane',
                             'comments': 'Contains single slice from {} channel'.format(
@@ -938,14 +1262,14 @@ class NwbFile():
                               # so perhaps we don't need to?
                               # ts.set_custom_dataset('channel', channel)
                               }
-                self.add_time_series_data(group_name, data=[img], times=np.array([0.0]),
+                self.add_time_series_data(group_name, data=img, times=np.array([0.0]),
                                           kind=TwoPhotonSeries,
                                           ts_attrs=ts_attrs, data_attrs=data_attrs)
                 # TODO Since this is only used when adding ROIs, it might be better
                 # to have a method that returns the acquisition name, rather than
                 # store the mapping.
                 self.zstack[plane_name][channel] = group_name
-        self._write()
+        self._changed()
 
     def add_rois(self, roi_path):
         """Add the locations of ROIs as an ImageSegmentation module.
@@ -969,31 +1293,22 @@ class NwbFile():
         organised by ROI number and channel name, so we can iterate there. Issue #16.
         """
         self.log('Loading ROI locations from {}', roi_path)
-        assert os.path.isfile(roi_path)
-        roi_data = pd.read_csv(
-            roi_path, sep='\t', header=0, index_col=False, dtype=np.float16,
-            converters={'Z start': np.float64, 'Z stop': np.float64}, memory_map=True)
+        # Pixel coordinates and counts are checked to be whole numbers and stored as integers,
+        # and everything else as doubles (see read_roi_dat).
+        # We open the file ourselves, rather than checking it exists first, so a missing
+        # file is reported (as FileNotFoundError) with only one trip to the file system
+        with open(roi_path, 'rb') as roi_file:
+            roi_data = read_roi_dat(
+                roi_file, int_columns=[column for column, field in ROI_COLUMNS.items() if field in _ROI_INT_FIELDS])
         # Rename the columns so that we can use them as identifiers later on
-        column_mapping = {
-            'ROI index': 'roi_index', 'Pixels in ROI': 'num_pixels',
-            'X start': 'x_start', 'Y start': 'y_start', 'Z start': 'z_start',
-            'X stop': 'x_stop', 'Y stop': 'y_stop', 'Z stop': 'z_stop',
-            'Laser Power (%)': 'laser_power', 'ROI Time (ns)': 'roi_time_ns',
-            'Angle (deg)': 'angle_deg', 'Composite ID': 'composite_id',
-            'Number of lines': 'num_lines', 'Frame Size': 'frame_size',
-            'Zoom': 'zoom', 'ROI group ID': 'roi_group_id'
-        }
-        roi_data.rename(columns=column_mapping, inplace=True)
+        roi_data.rename(columns=ROI_COLUMNS, inplace=True)
+        # Round the half precision fields to match existing files
+        roi_data = roi_data.astype({field: np.float16 for field in _ROI_HALF_PRECISION_FIELDS}, copy=False)
         module = self.nwb_file.create_processing_module(
             'Acquired_ROIs',
             'ROI locations and acquired fluorescence readings made directly by the AOL microscope.')
-        # Convert some columns to int
-        roi_data = roi_data.astype(
-            {'x_start': np.uint16, 'x_stop': np.uint16, 'y_start': np.uint16, 'y_stop': np.uint16,
-             'num_pixels': int})
         seg_iface = ImageSegmentation()
         module.add(seg_iface)
-        self._write()
         # Define the properties of the imaging plane itself, if not a Z plane
         self.custom_silverlab_dict['imaging_mode'] = self.mode.name
         if self.mode is Modes.pointing:
@@ -1004,50 +1319,67 @@ class NwbFile():
         grouped = roi_data.groupby('z_start', sort=False)
         # Iterate over planes and define ROIs
         self.roi_mapping = {}  # mapping from ROI ID to row index (used to look up ROIs)
+        imaging_planes = self.nwb_file.imaging_planes
         for plane_z, roi_group in grouped:
             plane_name = self.zplanes[plane_z]
-            plane_obj = self.nwb_file.imaging_planes[plane_name]
+            plane_obj = imaging_planes[plane_name]
+            # Adding ROIs to the table one row at a time is very slow, so we
+            # gather the full contents of each column first, and then add the
+            # columns in one go once the plane segmentation has been created.
+            # Each column is pulled out as a plain array, to avoid going through
+            # pandas for every field of every row.
+            columns = {field: roi_group[field].to_numpy(dtype=np.int64 if field in _ROI_INT_FIELDS else np.float64)
+                       for field in ROI_COLUMNS.values()}
+            roi_ids = columns['roi_index'].astype(int).tolist()
+            # The ROI mask only gives x & y coordinates - z is defined by the imaging plane.
+            # The coordinates are also relative to the imaging plane, not absolute. However, our
+            # plane coordinates run from 0 to frame_size, so that's easy to compute.
+            num_pixels = columns['num_pixels']
+            if self.mode is Modes.pointing:
+                assert np.all(num_pixels == 1), 'Unexpectedly large ROI in pointing mode'
+                num_x_pixels = num_y_pixels = np.ones_like(num_pixels)
+            else:
+                num_x_pixels = columns['x_stop'] - columns['x_start']
+                num_y_pixels = columns['y_stop'] - columns['y_start']
+            not_rectangular = np.flatnonzero(num_pixels != num_x_pixels * num_y_pixels)
+            assert not_rectangular.size == 0, 'ROI is not rectangular: {} != {} * {}'.format(
+                *(values[not_rectangular[0]] for values in (num_pixels, num_x_pixels, num_y_pixels)))
+            # Record the ROI dimensions for ease of lookup when adding functional data
+            all_dimensions = np.stack((num_x_pixels, num_y_pixels), axis=1).astype(np.int32)
+            # Pixels are located contiguously from start to stop coordinates, scanning X first.
+            # We compute them for all ROIs in the plane at once: for each pixel we find which
+            # ROI it belongs to, and its offset within that ROI.
+            pixel_mask_index = np.cumsum(num_pixels)  # end of each ROI's pixels within pixel_masks
+            pixel_roi = np.repeat(np.arange(num_pixels.size), num_pixels)
+            pixel_offset = np.arange(pixel_mask_index[-1]) - (pixel_mask_index - num_pixels)[pixel_roi]
+            # The third dimension in the pixels array indicates weight. All ROIs' pixels are
+            # kept in one flat array, which is stored as-is with pixel_mask_index as its index.
+            # The columns are computed in place to avoid allocating temporary arrays.
+            pixel_masks = np.empty((pixel_offset.size, 3), dtype=np.int64)
+            pixel_num_x = num_x_pixels[pixel_roi]
+            np.mod(pixel_offset, pixel_num_x, out=pixel_masks[:, 0])
+            pixel_masks[:, 0] += columns['x_start'][pixel_roi]
+            np.floor_divide(pixel_offset, pixel_num_x, out=pixel_masks[:, 1])
+            pixel_masks[:, 1] += columns['y_start'][pixel_roi]
+            pixel_masks[:, 2] = 1
+            pixel_mask_index = pixel_mask_index.tolist()
             plane = seg_iface.create_plane_segmentation(
                 description=plane_obj.description,
                 imaging_plane=plane_obj,
                 name=plane_name,
-                reference_images=self.nwb_file.acquisition[self.zstack[plane_name]['Red']]
+                reference_images=self.nwb_file.acquisition[self.zstack[plane_name]['Red']],
+                id=roi_ids
             )
-            # Specify the non-standard data we will be storing for each ROI,
-            # which includes all the raw data fields from the original file
-            plane.add_column('dimensions', 'Dimensions of the ROI')
-            for old_name, new_name in column_mapping.items():
-                plane.add_column(new_name, old_name)
-            index = 0  # index of the row as it will be stored in the ROI table
-            self.roi_mapping[plane_name] = {}
-            for row in roi_group.itertuples():
-                roi_id = int(row.roi_index)
-                # The ROI mask only gives x & y coordinates - z is defined by the imaging plane.
-                # The coordinates are also relative to the imaging plane, not absolute. However, our
-                # plane coordinates run from 0 to frame_size, so that's easy to compute.
-                # The third dimension in the pixels array indicates weight.
-                pixels = np.zeros((row.num_pixels, 3), dtype=np.uint16)
-                # Pixels are located contiguously from start to stop coordinates.
-                num_x_pixels = row.x_stop - row.x_start
-                num_y_pixels = row.y_stop - row.y_start
-                if self.mode is Modes.pointing:
-                    assert row.num_pixels == 1, 'Unexpectedly large ROI in pointing mode'
-                    num_x_pixels = num_y_pixels = 1
-                assert row.num_pixels == num_x_pixels * num_y_pixels, (
-                    'ROI is not rectangular: {} != {} * {}'.format(
-                        row.num_pixels, num_x_pixels, num_y_pixels))
-                # Record the ROI dimensions for ease of lookup when adding functional data
-                dimensions = np.array([num_x_pixels, num_y_pixels], dtype=np.int32)
-                for i in range(row.num_pixels):
-                    pixels[i, 0] = row.x_start + (i % num_x_pixels)
-                    pixels[i, 1] = row.y_start + (i // num_x_pixels)
-                    pixels[i, 2] = 1  # weight for this pixel
-                plane.add_roi(id=roi_id, pixel_mask=[tuple(r) for r in pixels.tolist()],
-                              dimensions=dimensions,
-                              **{field: getattr(row, field) for field in column_mapping.values()})
-                self.roi_mapping[plane_name][roi_id] = index
-                index += 1
-        self._write()
+            # Specify the non-standard data we are storing for each ROI, which
+            # includes all the raw data fields from the original file
+            plane.add_column('dimensions', 'Dimensions of the ROI', data=all_dimensions)
+            for old_name, new_name in ROI_COLUMNS.items():
+                plane.add_column(new_name, old_name, data=columns[new_name])
+            plane.add_column('pixel_mask', 'Pixel masks for each ROI',
+                             data=pixel_masks, index=pixel_mask_index)
+            # Rows in the ROI table are stored in the order the ROIs were given
+            self.roi_mapping[plane_name] = {roi_id: index for index, roi_id in enumerate(roi_ids)}
+        self._changed()
 
     def read_video_data(self, folder_path):
         """Link to video data stored in the given folder.
@@ -1070,24 +1402,56 @@ class NwbFile():
         """
         if av is None:
             raise ValueError('Unable to read video data without the av library installed')
+        # We re-read the file below, so it must be up to date on disk
+        self.flush()
+        self._close_hdf_file()
+
+        def probe_video(avi_file):
+            """Read the number of frames, frame rate, width and height of a video.
+
+            These normally all come from the container's header, so no frames are decoded.
+            If the header lacks a frame count, we count the video packets instead, which
+            still only reads the file once without decoding anything. The file is always
+            closed before returning, so we never hold many videos open at once.
+            """
+            container = av.open(avi_file)
+            try:
+                vid = container.streams.video[0]
+                frames = vid.frames
+                if not frames:
+                    frames = sum(1 for packet in container.demux(vid) if packet.pts is not None)
+                return frames, vid.rate, vid.width, vid.height
+            finally:
+                container.close()
+
         # Quick fix?
-        with NWBHDF5IO(self.nwb_path, 'a') as io:
+        with NWBHDF5IO(self.nwb_path, 'a') as io, ThreadPoolExecutor(max_workers=8) as executor:
             self.nwb_file = io.read()
             self.log('Loading video data from {}', folder_path)
             assert os.path.isdir(folder_path)
             nwb_dir = os.path.dirname(os.path.realpath(self.nwb_path))
             timing_suffix = '-relative times.txt'
-            timing_files = glob.glob(os.path.join(folder_path, '*' + timing_suffix))
-            for timing_file_path in timing_files:
-                cam_name = os.path.basename(timing_file_path)[:-len(timing_suffix)]
+            # List the folder just once, and find the files we need within that listing
+            file_names = _list_files(folder_path)
+            cam_names = [name[:-len(timing_suffix)] for name in fnmatch.filter(file_names, '*' + timing_suffix)]
+            avi_files = {cam_name: [os.path.join(folder_path, name)
+                                    for name in fnmatch.filter(file_names, cam_name + '-*.avi')]
+                         for cam_name in cam_names}
+            # Reading the video properties is mostly waiting on the disk, so this starts probing
+            # every file, for all cameras, in parallel; we collect the results in order below
+            video_props = {cam_name: executor.map(probe_video, avi_files[cam_name]) for cam_name in cam_names}
+            for cam_name in cam_names:
                 self.log('Camera: {}', cam_name)
-                frame_rel_times = pd.read_csv(timing_file_path, sep='\t', names=('Frame', 'RelTime'))
-                frame_rel_times['RelTime'] *= 1e-3  # Convert to seconds
+                timing_file_path = os.path.join(folder_path, cam_name + timing_suffix)
+                # We only need the times, so parse just that column, straight to floats
+                rel_times_ms = pd.read_csv(timing_file_path, sep='\t', header=None, names=('Frame', 'RelTime'),
+                                           usecols=['RelTime'], dtype={'RelTime': np.float64},
+                                           engine='c', memory_map=True)['RelTime'].values
+                frame_rel_times = rel_times_ms * 1e-3  # Convert to seconds
                 # Determine properties of each .avi file
-                avi_files = glob.glob(os.path.join(folder_path, cam_name + '-*.avi'))
-                num_frames = np.zeros((len(avi_files),), dtype=np.int64)
-                video_file_paths = [''] * len(avi_files)
-                for avi_file in avi_files:
+                num_frames = np.zeros((len(avi_files[cam_name]),), dtype=np.int64)
+                video_file_paths = [''] * len(avi_files[cam_name])
+                for avi_file, (frames, rate, width, height) in zip(avi_files[cam_name], video_props[cam_name]):
                     file_name = os.path.basename(avi_file)
                     self.log('Video: {}', file_name)
                     index = int(file_name[len(cam_name) + 1:-4]) - 1
@@ -1098,15 +1462,13 @@ class NwbFile():
                         # Particularly on Windows, it's sometimes impossible to construct
                         # a relative path, so fall back to absolute
                         video_file_paths[index] = avi_file
-                    container = av.open(avi_file)
-                    vid = container.streams.video[0]
-                    num_frames[index] = vid.frames
+                    num_frames[index] = frames
                     if index == 0:
-                        vid_rate = vid.rate
-                        vid_dimensions = [vid.width, vid.height]
-                    del container, vid
-                starting_frames = np.roll(np.cumsum(num_frames), 1)
-                starting_frames[0] = 0
+                        vid_rate = rate
+                        vid_dimensions = [width, height]
+                # Each file starts where the previous ones end
+                starting_frames = np.zeros_like(num_frames)
+                np.cumsum(num_frames[:-1], out=starting_frames[1:])
                 # Add camera to list of devices
                 self.nwb_file.create_device(
                     cam_name, self.user_metadata['devices'][cam_name])
@@ -1122,10 +1484,46 @@ class NwbFile():
                     'dimension': vid_dimensions,
                 }
                 self.add_time_series_data(
-                    cam_name, data=None, times=frame_rel_times['RelTime'].values,
+                    cam_name, data=None, times=frame_rel_times,
                     ts_attrs=ts_attrs, data_attrs=data_attrs, kind=ImageSeries)
             io.write(self.nwb_file)
 
+    def flush(self):
+        """Write any changes not yet saved to the NWB file on disk.
+
+        Each public method saves its own changes, so this is only needed if
+        changes have been made to the in-memory NWB file directly.
+        """
+        if self._dirty and self.nwb_file is not None:
+            self._write()
+
+    def _changed(self):
+        """Record that the in-memory NWB file has changes not yet on disk.
+
+        They are saved straight away, unless within _batch_writes.
+        """
+        self._dirty = True
+        if not self._batching:
+            self.flush()
+
+    @contextlib.contextmanager
+    def _batch_writes(self):
+        """Save changes once at the end of a block of steps, rather than after each.
+
+        If the block raises an exception, nothing is saved. Blocks may be nested,
+        in which case only the outermost one saves.
+        """
+        was_batching = self._batching
+        self._batching = True
+        try:
+            yield
+        finally:
+            self._batching = was_batching
+        if not was_batching:
+            self.flush()
+
     def _write(self):
+        self._close_hdf_file()
         with NWBHDF5IO(self.nwb_path, 'w') as io:
             io.write(self.nwb_file)
+        self._dirty = False
@@ -7,7 +7,7 @@ reference version.
 
 import argparse
 import collections
-import difflib
+import functools
 import numbers
 import os
 import re
@@ -15,13 +15,125 @@ import sys
 import zlib
 
 import h5py
-from numpy import array, dtype, hstack, int32, int64, ndarray, squeeze
+from numpy import (array, ascontiguousarray, dtype, empty, float16, float32, float64, hstack, int8, int16, int32, int64,
+                   ndarray, squeeze, uint8, uint16, uint32, uint64)
+
+try:
+    # Registers the filters needed to read datasets compressed with Bitshuffle
+    import hdf5plugin  # noqa: F401
+except ImportError:
+    # This dependency is optional
+    pass
+
+try:
+    # A compiled drop-in for difflib.unified_diff, much faster on large signatures
+    from difflib_rs import unified_diff
+except ImportError:
+    # This dependency is optional
+    from difflib import unified_diff
+
+try:
+    import google_crc32c
+except ImportError:
+    # This dependency is optional
+    google_crc32c = None
+
+try:
+    import xxhash
+except ImportError:
+    # This dependency is optional
+    xxhash = None
+
+
+class _Checksum:
+    """A running checksum, hashed a piece at a time like the xxhash hashers.
+
+    :param update: function taking the next piece of data and the running checksum,
+        and returning the new checksum, e.g. zlib.adler32
+    :param start: the checksum of no data
+    """
+
+    def __init__(self, update, start):
+        self._update = update
+        self._checksum = start
+
+    def update(self, data):
+        self._checksum = self._update(data, self._checksum)
+
+    def intdigest(self):
+        return self._checksum
+
+
+# The checksums we can use to hash values, as functions returning a new hasher. A hasher
+# is given data a piece at a time through its update method, and the result, from its
+# intdigest method, does not depend on how the data was split. Reference signatures use
+# adler32; the others are faster on large datasets, but signatures made with them can only
+# be compared against each other.
+HASH_ALGORITHMS = {
+    'adler32': functools.partial(_Checksum, zlib.adler32, 1),
+    'crc32': functools.partial(_Checksum, zlib.crc32, 0),
+}
+if google_crc32c is not None:
+    # Uses the CPU's CRC32C instruction where available
+    HASH_ALGORITHMS['crc32c'] = functools.partial(_Checksum, lambda data, crc: google_crc32c.extend(crc, data), 0)
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh3'] = xxhash.xxh3_64
+
+# How to format the scalar types we commonly read from HDF5, looked up by exact type so
+# that SignatureGenerator.format_value can usually skip its chain of isinstance checks
+_SCALAR_FORMATTERS = {str: lambda val: val, bytes: lambda val: val.decode('utf-8')}
+_SCALAR_FORMATTERS.update(dict.fromkeys(
+    [int, int8, int16, int32, int64, uint8, uint16, uint32, uint64], u'%d'.__mod__))
+_SCALAR_FORMATTERS.update(dict.fromkeys([float, float16, float32, float64], u'%.10g'.__mod__))
 
 
 def cast_to_object(string):
     return squeeze(array([string], dtype='O'))
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_substitutions(substitutions):
+    """Compile (pattern, replacement) pairs once, however many converters use them.
+
+    :param substitutions: a tuple of (regular expression string, replacement) pairs
+    :returns: a tuple of (compiled regular expression, replacement) pairs
+    """
+    return tuple((re.compile(match), repl) for match, repl in substitutions)
+
+
+# The flags a pattern has if it sets none itself
+_DEFAULT_FLAGS = re.compile('').flags
+
+
+def _can_combine(pattern):
+    """Whether a compiled regular expression means the same within an alternation.
+
+    Patterns setting global flags inline (e.g. ``(?i)``), or with capturing groups,
+    which could be referred to by number (e.g. ``\\1`` or ``(?(1)...)``), would change
+    meaning or fail to compile when joined with others.
+    """
+    return pattern.flags == _DEFAULT_FLAGS and pattern.groups == 0
+
+
+def _combine_patterns(patterns):
+    """Combine compiled regular expressions into as few as possible.
+
+    Those that can be are joined into a single alternation; any others are kept as
+    they are, to be matched separately.
+
+    :param patterns: a list of compiled regular expressions
+    :returns: a tuple of compiled regular expressions, which together match where
+        any of the originals do
+    """
+    combinable = [pattern.pattern for pattern in patterns if _can_combine(pattern)]
+    combined = tuple(pattern for pattern in patterns if not _can_combine(pattern))
+    if len(combinable) == 1:
+        combined = (re.compile(combinable[0]),) + combined
+    elif combinable:
+        combined = (re.compile('|'.join('(?:{})'.format(pattern) for pattern in combinable)),) + combined
+    return combined
+
+
 class SignatureGenerator:
     """The workhorse class for generating NWB file signatures.
 
@@ -35,8 +147,17 @@ class SignatureGenerator:
         assert sig_gen.compare_to_sig(path_to_nwb, path_to_sig)
     """
 
-    def __init__(self):
-        """Create a signature generator."""
+    def __init__(self, hash_algorithm='adler32'):
+        """Create a signature generator.
+
+        :param hash_algorithm: the checksum to use for hashing values; one of the keys of
+            HASH_ALGORITHMS. The reference signatures use the default, adler32.
+        """
+        if hash_algorithm not in HASH_ALGORITHMS:
+            raise ValueError('Unknown hash algorithm {}; expected one of {}'.format(
+                hash_algorithm, ', '.join(sorted(HASH_ALGORITHMS))))
+        self._new_hasher = HASH_ALGORITHMS[hash_algorithm]
+        # Patterns are combined into as few as possible when first needed
         self._ignore_paths = [re.compile(s) for s in [
             '/file_create_date',
             '/identifier',
@@ -44,7 +165,10 @@ class SignatureGenerator:
             '/specifications/hdmf-common/*',
             '/specifications/silverlab_extended_schema/*',
         ]]
-        self._ignore_attributes = []
+        self._ignore_paths_combined = None
+        # Path patterns for ignored attributes, by attribute name
+        self._ignore_attributes = collections.defaultdict(list)
+        self._ignore_attributes_combined = {}
         for path, attr in [
             ('.*', 'help'),
             ('.*', 'namespace'),
@@ -55,6 +179,7 @@ class SignatureGenerator:
             self.ignore_attribute(path, attr)
         # some datasets need platform-specific correction of type
         self._cast_paths = {}
+        self._cast_cache = {}  # Results of should_cast_path, by (path, type)
         for dataset_path, expected, corrected in [
             ('/acquisition/EyeCam/dimension', int32, int64),
             ('/acquisition/WhiskersCam/dimension', int32, int64),
@@ -70,6 +195,11 @@ class SignatureGenerator:
             ('/processing/Acquired_ROIs/.*/y_stop', int32, int64),
         ]:
             self.set_cast_path(dataset_path, expected, corrected)
+        # ROI data used to be stored in double precision. The values are integers, so we
+        # hash them widened back to double, keeping the reference hashes, but the
+        # signature still shows the type actually stored.
+        self._hash_types = {}
+        self.set_hash_type('/acquisition/ROI_.*/data', float32, float64)
         # some attributes need platform-specific casting
         for attr_path, expected, corrected in [
             ('/general/silverlab_optophysiology/cycles_per_trial', int32, int64),
@@ -86,6 +216,7 @@ class SignatureGenerator:
         :param pattern: a regular expression string
         """
         self._ignore_paths.append(re.compile(pattern + '$'))
+        self._ignore_paths_combined = None
 
     def ignore_attribute(self, path, attr):
         """Don't generate signatures for the given attribute(s).
@@ -93,7 +224,8 @@ class SignatureGenerator:
         :param path: regular expression path to the dataset/group on which the attribute is found
         :param attr: name of the attribute as a fixed string (not regular expression)
         """
-        self._ignore_attributes.append((re.compile(path + '$'), attr))
+        self._ignore_attributes[attr].append(re.compile(path + '$'))
+        self._ignore_attributes_combined.pop(attr, None)
 
     def set_cast_path(self, path, expected_type, corrected_type):
         """Cast path (dataset or attribute) to corrected_type.
@@ -106,6 +238,19 @@ class SignatureGenerator:
         :param corrected_type: if path is of expected_type, it will need casting to this type
         """
         self._cast_paths[re.compile(path + '$')] = {"expected": expected_type, "corrected": corrected_type}
+        self._cast_cache.clear()
+
+    def set_hash_type(self, path, stored_type, hash_type):
+        """Hash a dataset's values as hash_type, while reporting its stored type.
+
+        Unlike set_cast_path, the signature still records the dataset's real type, so a
+        change of type is detected even when the values hash the same.
+
+        :param path: regular expression path to the dataset
+        :param stored_type: only datasets of this type are converted
+        :param hash_type: the type to convert the values to before hashing them
+        """
+        self._hash_types[re.compile(path + '$')] = {"stored": stored_type, "hash": hash_type}
 
     def generate(self, nwb_path):
         """Generate a signature for a NWB file.
@@ -113,17 +258,23 @@ class SignatureGenerator:
         :param nwb_path: path to the NWB file
         :returns: a string with the signature
         """
+        return u''.join(self.generate_iter(nwb_path))
+
+    def generate_iter(self, nwb_path):
+        """Generate a signature for a NWB file a piece at a time.
+
+        :param nwb_path: path to the NWB file
+        :returns: an iterator over strings that together make up the signature
+        """
         assert os.path.exists(nwb_path), 'NWB file {} does not exist'.format(nwb_path)
-        header = 'Generating signature for {}\n\n'.format(os.path.basename(nwb_path))
-        f = h5py.File(nwb_path, 'r')
-        sig = self.group_sig(f)
-        f.close()
-        return header + sig
+        yield 'Generating signature for {}\n\n'.format(os.path.basename(nwb_path))
+        with h5py.File(nwb_path, 'r') as f:
+            yield from self._group_sig_parts(f)
 
     def save_sig(self, nwb_path, sig_path):
         """Generate a signature for an NWB file and save to `sig_path`."""
         with open(sig_path, 'wt') as sig_f:
-            sig_f.write(self.generate(nwb_path))
+            sig_f.writelines(self.generate_iter(nwb_path))
 
     def compare_to_sig(self, nwb_path, sig_path, verbose=True):
         """Test whether an NWB file matches the expected signature.
@@ -137,14 +288,20 @@ class SignatureGenerator:
         :returns: True iff the signature matches
         """
         assert os.path.exists(sig_path), 'Signature file {} does not exist'.format(sig_path)
-        actual_sig = self.generate(nwb_path)
-        with open(sig_path) as sig_f:
-            expected_sig = sig_f.read()
-        match = expected_sig == actual_sig
+        # Check the signature against the file as it is generated, stopping at the first difference
+        parts = self.generate_iter(nwb_path)
+        try:
+            with open(sig_path) as sig_f:
+                match = all(sig_f.read(len(part)) == part for part in parts) and not sig_f.read(1)
+        finally:
+            parts.close()
         if match and verbose:
             print('Signature matches for file {}'.format(os.path.basename(nwb_path)))
         elif verbose:
-            diff = difflib.unified_diff(
+            actual_sig = self.generate(nwb_path)
+            with open(sig_path) as sig_f:
+                expected_sig = sig_f.read()
+            diff = unified_diff(
                 expected_sig.splitlines(), actual_sig.splitlines(),
                 fromfile=sig_path, tofile=nwb_path, lineterm='')
             for line in diff:
@@ -158,29 +315,39 @@ class SignatureGenerator:
 
         :returns: a string with the signature
         """
+        return u''.join(self._group_sig_parts(group))
+
+    def _group_sig_parts(self, group):
+        """Generate the signature for an NWB group a piece at a time.
+
+        :returns: an iterator over strings making up the group's signature
+        """
         self._current_group = group
-        attrs_sig = self.attrs_sig(group)
-        sig = [group.name + attrs_sig + u'\n' if attrs_sig else u'']
-        if self.ignored_path(group.name):
-            return u''.join(sig)
+        # h5py asks HDF5 for an object's name each time, so we look it up only once
+        group_path = group.name
+        attrs_sig = self.attrs_sig(group, group_path)
+        if attrs_sig:
+            yield group_path + attrs_sig + u'\n'
+        if self.ignored_path(group_path):
+            return
+        child_prefix = group_path if group_path == u'/' else group_path + u'/'
         for name in sorted(group):
-            item_type = group.get(name, getclass=True, getlink=True)
-            if item_type is h5py.HardLink:
-                item_type = group.get(name, getclass=True)
-            if item_type is h5py.Group:
-                sig.append(self.group_sig(group[name]))
-            elif item_type is h5py.Dataset:
-                sig.append(self.dataset_sig(group[name]))
-            elif item_type in {h5py.SoftLink, h5py.ExternalLink}:
-                path = u'{}{}{}'.format(group.name, u'' if group.name == u'/' else u'/', name)
+            # One lookup gives us both the kind of link and, for soft/external links, its target
+            link = group.get(name, getlink=True)
+            if isinstance(link, h5py.HardLink):
+                item = group[name]
+                if isinstance(item, h5py.Group):
+                    yield from self._group_sig_parts(item)
+                elif isinstance(item, h5py.Dataset):
+                    yield self.dataset_sig(item)
+            elif isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+                path = child_prefix + name
                 if self.ignored_path(path):
                     continue
-                link = group.get(name, getlink=True)
-                if item_type is h5py.SoftLink:
-                    sig.append(u'{} -> {}\n'.format(path, link.path))
-                elif item_type is h5py.ExternalLink:
-                    sig.append(u'{} -> {}:{}\n'.format(path, link.filename, link.path))
-        return u''.join(sig)
+                if isinstance(link, h5py.SoftLink):
+                    yield u'{} -> {}\n'.format(path, link.path)
+                else:
+                    yield u'{} -> {}:{}\n'.format(path, link.filename, link.path)
 
     def dataset_sig(self, dataset):
         """Generate a signature for an NWB dataset.
@@ -188,33 +355,78 @@ class SignatureGenerator:
         :returns: a string with the signature
         """
         path = dataset.name
-        attrs = self.attrs_sig(dataset)
+        attrs = self.attrs_sig(dataset, path)
         if self.ignored_path(path):
             shape = data_type = val = 'ignored'
         else:
             shape = dataset.shape
             data_type = dataset.dtype
-            original_val = dataset[()]
             cast_type = self.should_cast_path(path, data_type)
+            hash_type = cast_type if cast_type is not None else self._hash_type(path, data_type)
+            is_large_simple = self._is_large_simple(shape, data_type)
             if cast_type is not None:
                 # note that     np.dtype(np.int32)  ==     np.int32  is True
                 # but       str(np.dtype(np.int32)) == str(np.int32) is False
                 data_type = dtype(cast_type)
-                original_val = cast_type(original_val)
-            if shape == ():
-                val = self.format_value(original_val)
-                if len(val) > 30:
-                    val = val[:27] + u'...' + self.value_hash(val.encode('utf-8'))
-            elif shape == (1,):
-                val = self.format_value(original_val[0])
-                if len(val) > 30:
-                    val = val[:27] + u'...' + self.value_hash(val.encode('utf-8'))
-                val = u'[%s]' % val
+            if is_large_simple:
+                # Hash straight from the file rather than loading it all into memory
+                val = self.dataset_hash(dataset, hash_type)
             else:
-                val = self.array_hash(original_val)
+                original_val = dataset[()]
+                if hash_type is not None:
+                    original_val = hash_type(original_val)
+                if shape == ():
+                    val = self.format_value(original_val)
+                    if len(val) > 30:
+                        val = val[:27] + u'...' + self.value_hash(val.encode('utf-8'))
+                elif shape == (1,):
+                    val = self.format_value(original_val[0])
+                    if len(val) > 30:
+                        val = val[:27] + u'...' + self.value_hash(val.encode('utf-8'))
+                    val = u'[%s]' % val
+                else:
+                    val = self.array_hash(original_val)
         return u'{}: dtype={} shape={} val="{}"{}\n'.format(
             path, data_type, shape, val, attrs)
 
+    def _is_large_simple(self, shape, data_type):
+        """Whether a dataset is big enough to hash in blocks, and of a type that allows it."""
+        if not shape or data_type.kind in ['O', 'V']:
+            return False
+        nbytes = data_type.itemsize
+        for dim in shape:
+            nbytes *= dim
+        return nbytes > self.HASH_BLOCK_BYTES
+
+    def dataset_hash(self, dataset, cast_type=None):
+        """Return a short string hash of a simple-typed dataset's contents.
+
+        The dataset is read from the file a block of rows at a time into a reused buffer,
+        so only one block need be in memory. Since the rows are visited in order, and the
+        hash doesn't depend on how its input is split, the result is the same as from
+        array_hash on the whole (cast) dataset.
+
+        :param dataset: an h5py dataset with a numeric or fixed-length string dtype
+        :param cast_type: if given, the type to cast each block to before hashing it
+        """
+        shape = dataset.shape
+        row_bytes = dataset.dtype.itemsize
+        for dim in shape[1:]:
+            row_bytes *= dim
+        rows_per_block = max(1, self.HASH_BLOCK_BYTES // max(1, row_bytes))
+        if dataset.chunks is not None and rows_per_block > dataset.chunks[0]:
+            # Read whole HDF5 chunks at once where we can
+            rows_per_block -= rows_per_block % dataset.chunks[0]
+        buffer = empty((min(rows_per_block, shape[0]),) + shape[1:], dtype=dataset.dtype)
+        hasher = self._new_hasher()
+        for start in range(0, shape[0], rows_per_block):
+            block = buffer[:min(rows_per_block, shape[0] - start)]
+            dataset.read_direct(block, source_sel=slice(start, start + len(block)))
+            if cast_type is not None:
+                block = block.astype(cast_type)
+            self._hash_buffer(block, hasher)
+        return hex(hasher.intdigest() & 0xffffffff)
+
     def array_hash(self, array):
         """Return a short string hash of an ndarray's contents.
 
@@ -229,15 +441,33 @@ class SignatureGenerator:
             else:
                 return self.value_hash(array.astype(bytes).tobytes())
         else:
-            return self.value_hash(array.tobytes())
+            return self.value_hash(ascontiguousarray(array))
+
+    # How many bytes to hash at once, so large values are hashed while in cache
+    HASH_BLOCK_BYTES = 1024 * 1024
 
     def value_hash(self, value):
         """Return a short string hash of a potentially large value.
 
-        :param value: a byte string to hash
+        The value is hashed directly from its buffer, a block at a time, so no copy of
+        it is made. The result is the same as hashing the equivalent byte string.
+
+        :param value: a byte string, or other contiguous buffer (such as an ndarray), to hash
         :returns: a hexadecimal representation of a 32-bit hash
         """
-        return hex(zlib.adler32(value) & 0xffffffff)
+        hasher = self._new_hasher()
+        self._hash_buffer(value, hasher)
+        return hex(hasher.intdigest() & 0xffffffff)
+
+    def _hash_buffer(self, value, hasher):
+        """Feed the bytes of a contiguous buffer to a hasher, a block at a time."""
+        if isinstance(value, ndarray):
+            # Viewing the array as bytes works for every simple dtype, including those
+            # (such as datetime64) that the buffer protocol can't export
+            value = ascontiguousarray(value).view(uint8).reshape(-1)
+        data = memoryview(value).cast('B')
+        for start in range(0, len(data), self.HASH_BLOCK_BYTES):
+            hasher.update(data[start:start + self.HASH_BLOCK_BYTES])
 
     def format_value(self, val):
         """Format a single value nicely as a unicode string.
@@ -246,7 +476,10 @@ class SignatureGenerator:
 
         Assumes utf-8 encoding if bytes.
         """
-        if isinstance(val, str):
+        formatter = _SCALAR_FORMATTERS.get(type(val))
+        if formatter is not None:
+            formatted_val = formatter(val)
+        elif isinstance(val, str):
             formatted_val = val
         elif isinstance(val, bytes):
             formatted_val = val.decode('utf-8')
@@ -262,22 +495,28 @@ class SignatureGenerator:
             formatted_val = self.value_hash(val.tobytes())
         return formatted_val
 
-    def attrs_sig(self, entity):
+    def attrs_sig(self, entity, entity_path=None):
         """Generate a signature of the attributes for a group or dataset.
 
         :param entity: an h5py group or dataset
+        :param entity_path: the entity's name, if already known
         :returns: a string with the signature, one line per attribute
         """
-        sig = u''
-        for name, value in sorted(entity.attrs.items()):
-            if not self.ignored_attr(entity.name, name):
-                corrected_type = None
-                if hasattr(value, 'dtype'):
-                    corrected_type = self.should_cast_path(entity.name + '/' + name, value.dtype)
-                if corrected_type is not None:
-                    value = corrected_type(value)
-                sig = sig + u'\n\t@{}: {}'.format(name, self.attr_val(value))
-        return sig
+        sig = []
+        if entity_path is None:
+            entity_path = entity.name
+        # Only read the values of attributes we are not ignoring
+        for name in sorted(entity.attrs):
+            if self.ignored_attr(entity_path, name):
+                continue
+            value = entity.attrs[name]
+            corrected_type = None
+            if hasattr(value, 'dtype'):
+                corrected_type = self.should_cast_path(entity_path + '/' + name, value.dtype)
+            if corrected_type is not None:
+                value = corrected_type(value)
+            sig.append(u'\n\t@{}: {}'.format(name, self.attr_val(value)))
+        return u''.join(sig)
 
     def attr_val(self, val):
         """Return a consistent representation of an attribute's value."""
@@ -290,26 +529,40 @@ class SignatureGenerator:
 
     def ignored_attr(self, parent_path, attr_name):
         """Should we ignore this attribute?"""
-        for path_re, ignored_name in self._ignore_attributes:
-            if path_re.match(parent_path) and attr_name == ignored_name:
-                return True
-        return False
+        if attr_name not in self._ignore_attributes:
+            return False
+        path_res = self._ignore_attributes_combined.get(attr_name)
+        if path_res is None:
+            path_res = self._ignore_attributes_combined[attr_name] = _combine_patterns(
+                self._ignore_attributes[attr_name])
+        return any(path_re.match(parent_path) for path_re in path_res)
 
     def ignored_path(self, path):
         """Should we ignore this entity path?"""
-        for path_re in self._ignore_paths:
-            if path_re.match(path):
-                return True
-        return False
+        if self._ignore_paths_combined is None:
+            self._ignore_paths_combined = _combine_patterns(self._ignore_paths)
+        return any(path_re.match(path) for path_re in self._ignore_paths_combined)
+
+    def _hash_type(self, path, stored_type):
+        """The type to convert a dataset's values to for hashing, if any (see set_hash_type)."""
+        for key, types in self._hash_types.items():
+            if key.match(path) and types["stored"] == stored_type:
+                return types["hash"]
+        return None
 
     def should_cast_path(self, path, encountered_type):
         """Should we cast this entity path, and if so, to what type?
         :return: either ``None`` if no casting needed or the type to cast to
         """
-        for key, types in self._cast_paths.items():
-            if key.match(path) and types["expected"] == encountered_type:
-                return types["corrected"]
-        return None
+        cache_key = (path, encountered_type)
+        if cache_key not in self._cast_cache:
+            corrected_type = None
+            for key, types in self._cast_paths.items():
+                if key.match(path) and types["expected"] == encountered_type:
+                    corrected_type = types["corrected"]
+                    break
+            self._cast_cache[cache_key] = corrected_type
+        return self._cast_cache[cache_key]
 
 
 class SignatureConverter:
@@ -368,12 +621,20 @@ class SignatureConverter:
 
     def __init__(self):
         """Create a signature converter."""
-        self.re_changes = list(map(
-            lambda match_repl: (re.compile(match_repl[0]), match_repl[1]),
-            self.RE_CHANGES))
-        self.hoists = list(map(
-            lambda match_repl: (re.compile(match_repl[0]), match_repl[1]),
-            self.HOISTS))
+        self.re_changes = _compile_substitutions(tuple(self.RE_CHANGES))
+        self.hoists = _compile_substitutions(tuple(self.HOISTS))
+        # Changes that remove a line entirely are all anchored and leave the start of the
+        # line alone, so we can check for them with one pattern once the rest are applied
+        self._deletions = _combine_patterns([match for match, repl in self.re_changes if not repl])
+        rewrites = [(match, repl) for match, repl in self.re_changes if repl]
+        # Most changes are anchored to apply only to attribute lines (which start with a tab)
+        # or only to other lines, so we sort them into a table for each kind of line up front
+        self._attr_changes = tuple(
+            (match, repl) for match, repl in rewrites
+            if not match.pattern.startswith(('^/', '^(/', '^\\S', '^(\\S')))
+        self._other_changes = tuple(
+            (match, repl) for match, repl in rewrites
+            if not match.pattern.startswith(('^\\t', '^(\\t')))
 
     def convert(self, sig_path):
         """Convert an NWB1 signature to be more like NWB2.
@@ -381,13 +642,11 @@ class SignatureConverter:
         with open(sig_path, 'r') as sig_file:
             lines = sig_file.readlines()
         # Don't modify the header
-        for line in lines[:2]:
-            print(line, end='')
+        header, lines = lines[:2], lines[2:]
         # Handle hoisting
-        lines = self.hoist(iter(lines[2:]))
-        # Transform each non-header line
-        for line in lines:
-            print(self.convert_line(line), end='')
+        lines = self.hoist(iter(lines))
+        # Transform each non-header line, writing the result out in one go
+        sys.stdout.write(u''.join(header + [self.convert_line(line) for line in lines]))
 
     def hoist(self, lines):
         """Hoist some datasets to become attributes of the parent group.
@@ -426,11 +685,9 @@ class SignatureConverter:
             group_members[meta['last_parent']] = [line]
 
         for line in lines:
-            line_meta = self.META.match(line)
-            name = line_meta.group('name')
-            path = line_meta.group('path') or ''
+            path, name, is_attr, is_dataset = self._parse_meta(line)
             level = path.count('/')
-            if not line_meta.group('dataset'):
+            if not is_dataset:
                 # This is a group
                 if meta['this_group'] is not None:
                     finish_group('new group')
@@ -439,7 +696,7 @@ class SignatureConverter:
                 if meta['this_group'] is None:
                     # We're not hoisting at present; just output unchanged
                     new_lines.append(line)
-                elif line_meta.group('attr'):
+                elif is_attr:
                     # This is an attribute that just needs to be logged
                     group_members[meta['last_parent']].append(line)
                 else:
@@ -466,12 +723,39 @@ class SignatureConverter:
             finish_group('final group')
         return new_lines
 
+    def _parse_meta(self, line):
+        """Pick out the parts of a signature line that META would match.
+
+        Uses plain string methods for the attribute and path lines that make up signatures,
+        falling back to the META regular expression for anything else.
+
+        :returns: a tuple (group path, base item name, is an attribute, is a dataset/link)
+        """
+        if line.startswith('\t'):
+            is_attr, path, start, separators = True, '', 1, ' /:'
+        elif line.startswith('/'):
+            is_attr, start, separators = False, 0, ' :'
+        else:
+            line_meta = self.META.match(line)
+            return (line_meta.group('path') or '', line_meta.group('name'),
+                    bool(line_meta.group('attr')), bool(line_meta.group('dataset')))
+        end = len(line)
+        for separator in separators:
+            index = line.find(separator, start, end)
+            if index != -1:
+                end = index
+        if not is_attr:
+            start = line.rfind('/', 0, end) + 1
+            path = line[:start]
+        is_dataset = line.startswith(':', end) or line.startswith(' ->', end)
+        return path, line[start:end], is_attr, is_dataset
+
     def convert_line(self, line):
         """Convert a single line of a signature."""
-        for match_repl in self.re_changes:
-            match, repl = match_repl
+        changes = self._attr_changes if line.startswith('\t') else self._other_changes
+        for match, repl in changes:
             line = match.sub(repl, line)
-        if not line.strip():
+        if not line.strip() or any(deletion.match(line) for deletion in self._deletions):
             return ''  # Allow substitutions to remove lines entirely
         else:
             return line
@@ -498,9 +782,12 @@ def cli():
                         help='launch pdb on error')
     parser.add_argument('-i', '--ignore-path', nargs='*', default=[],
                         help='ignore datasets matching the given regular expression path')
+    parser.add_argument('--hash', choices=sorted(HASH_ALGORITHMS), default='adler32',
+                        help='checksum used to hash values (signatures made with different'
+                             ' checksums cannot be compared)')
     args = parser.parse_args()
     try:
-        sig_gen = SignatureGenerator()
+        sig_gen = SignatureGenerator(hash_algorithm=args.hash)
         for ignore_path in args.ignore_path:
             sig_gen.ignore_path(ignore_path)
         if args.sig_path:
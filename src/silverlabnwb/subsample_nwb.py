@@ -12,6 +12,7 @@ import argparse
 import glob
 import os
 import subprocess
+import tempfile
 
 import av
 import h5py
@@ -51,11 +52,14 @@ def subsample_nwb(nwb, input_path, output_path, ntrials=2, nrois=10):
     # Copy subset of TDMS files
     tdms_path = 'Functional imaging TDMS data files'
     os.makedirs(os.path.join(output_path, tdms_path), exist_ok=True)
+    # These are the same for every trial, so only read them from the NWB file once
+    num_cycles = cycles_per_trial(nwb)
+    num_all_rois = nwb['/processing/Acquired_ROIs/roi_spec'].shape[0]
     for tr in range(1, ntrials + 1):
         tdms_name = '{:03d}.tdms'.format(tr)
         tdms_in = os.path.join(input_path, tdms_path, tdms_name)
         tdms_out = os.path.join(output_path, tdms_path, tdms_name)
-        copy_tdms(nwb, tdms_in, tdms_out, nrois)
+        copy_tdms(tdms_in, tdms_out, nrois, num_cycles, num_all_rois)
     # Find videos defined
     video_names = [name for name in nwb['/acquisition/timeseries'].keys()
                    if name.endswith('Cam')]
@@ -76,19 +80,27 @@ def subsample_nwb(nwb, input_path, output_path, ntrials=2, nrois=10):
 def find_used_planes(nwb, nrois):
     used_planes = set()
     seg_iface = nwb['/processing/Acquired_ROIs/ImageSegmentation']
-    for plane_name in seg_iface.keys():
-        plane_num = int(plane_name[-4:])
-        for roi_name in seg_iface[plane_name].keys():
-            if roi_name.startswith('ROI_'):
-                roi_num = int(roi_name[4:])
-                if roi_num <= nrois:
-                    used_planes.add(plane_num)
+    for plane_name, plane in seg_iface.items():
+        # A plane is used as soon as we find one kept ROI in it
+        if any(roi_num is not None and roi_num <= nrois
+               for roi_num in map(roi_number, plane.keys())):
+            used_planes.add(int(plane_name[-4:]))
     used_planes = list(used_planes)
     used_planes.sort()
     print('Relevant Zstack planes are:', used_planes)
     return used_planes
 
 
+def roi_number(name):
+    """Get the number of an ROI from its group name, or None if it is not an ROI."""
+    if name.startswith('ROI_'):
+        try:
+            return int(name[4:])
+        except ValueError:
+            pass
+    return None
+
+
 def copy_zstack(input_path, output_path, zstack_planes):
     dirname = 'Zstack Images'
     sources = glob.glob(os.path.join(input_path, dirname, '*Channel*.tif'))
@@ -199,19 +211,20 @@ def cycles_per_trial(nwb):
         raise ValueError('No imaging timeseries found')
 
 
-def copy_tdms(nwb, in_path, out_path, nrois):
-    num_all_rois = nwb['/processing/Acquired_ROIs/roi_spec'].shape[0]
+def copy_tdms(in_path, out_path, nrois, num_cycles, num_all_rois):
     print('Copying {} of {} ROIs from {} to {}'.format(
         nrois, num_all_rois, in_path, out_path))
-    in_tdms = nptdms.TdmsFile(in_path)
+    # Map the channel data from disk, so only the ROIs we keep are read into memory
+    in_tdms = nptdms.TdmsFile(in_path, memmap_dir=tempfile.gettempdir())
     group_name = 'Functional Imaging Data'
+    # The same for both channels
+    shape = (num_cycles, num_all_rois, -1)
     with nptdms.TdmsWriter(out_path) as out_tdms:
         root, group = in_tdms.object(), in_tdms.object(group_name)
         out_tdms.write_segment([root, group])
         for ch, channel in {'0': 'Red', '1': 'Green'}.items():
             ch_name = 'Channel {} Data'.format(ch)
             ch_obj = in_tdms.object(group_name, ch_name)
-            shape = (cycles_per_trial(nwb), num_all_rois, -1)
             ch_data = ch_obj.data.reshape(shape)
             subset = ch_data[:, :nrois, :].reshape(-1)
             new_obj = nptdms.ChannelObject(group_name, ch_name, subset, properties={})
@@ -4,6 +4,31 @@ import numpy as np
 import pandas as pd
 
 
+def read_roi_dat(roi_file, usecols=None, int_columns=()):
+    """Read the table of ROI definitions from a ROI.dat file.
+
+    All columns are parsed as doubles, since whole numbers are not always written without
+    a decimal point (e.g. ``100.0``). The columns listed in int_columns are then checked
+    to hold only whole numbers, and converted to 64-bit integers.
+
+    :param roi_file: path to, or open binary file object for, the ROI.dat file
+    :param usecols: if given, only read these columns
+    :param int_columns: the names of columns holding whole numbers, e.g. pixel coordinates
+    :returns: a pandas DataFrame with the file's column names
+    :raises ValueError: if an integer column has a missing or fractional value
+    """
+    roi_data = pd.read_csv(roi_file, sep='\t', header=0, index_col=False, usecols=usecols,
+                           dtype=np.float64, engine='c', float_precision='round_trip')
+    for column in int_columns:
+        values = roi_data[column].values
+        not_whole = np.flatnonzero(~np.isfinite(values) | (values != np.round(values)))
+        if not_whole.size:
+            raise ValueError('ROI.dat column "{}" must hold whole numbers, but row {} is {}'.format(
+                column, not_whole[0] + 1, values[not_whole[0]]))
+        roi_data[column] = values.astype(np.int64)
+    return roi_data
+
+
 class LabViewTimings(metaclass=abc.ABCMeta):
     """A class for storing pixel-level timing information for an ROI."""
 
@@ -16,27 +41,35 @@ class LabViewTimings(metaclass=abc.ABCMeta):
     def _read_relative_times_file(self, file_path):
         pass
 
+    # The ROI.dat columns we need to work out the shape of each ROI, and those holding pixel
+    # coordinates, which must be whole numbers (see read_roi_dat).
+    roi_columns = ('ROI index', 'X start', 'X stop', 'Y start', 'Y stop', 'Angle (deg)')
+    roi_int_columns = ('X start', 'X stop', 'Y start', 'Y stop')
+
     def _read_roi_data(self, roi_path):
-        self.roi_data = pd.read_csv(roi_path, sep='\t', dtype=np.float64)
+        self.roi_data = read_roi_dat(roi_path, usecols=self.roi_columns, int_columns=self.roi_int_columns)
+        # Keep each column as a plain array, so that looking up values doesn't go through pandas
+        self.x_start, self.x_stop, self.y_start, self.y_stop, self.angle = (
+            self.roi_data[column].values for column in self.roi_columns[1:])
         self.n_rois = len(self.roi_data['ROI index'])
         # in the future, we can access more shape parameters here too, for variable size ROIs in those cases,
         # we will need to access each individual row here separately. for now, take first row and all ROIs are same
         # size and orientation. Also, we may need to store the angle somewhere in the future (to reconstruct the ROI
         # in 3D, in which case the ==0 assertion may become imprecise and we would need a tolerance to compare with a
         # double value.
-        n_y_pixels = int(self.roi_data['Y stop'][0] - self.roi_data['Y start'][0])
-        n_x_pixels = int(self.roi_data['X stop'][0] - self.roi_data['X start'][0])
-        if self.roi_data['Angle (deg)'][0] == 0:
-            self.n_lines_per_roi = n_y_pixels
-            self.n_pixels_per_line = n_x_pixels
-        else:
-            self.n_lines_per_roi = n_x_pixels
-            self.n_pixels_per_line = n_y_pixels
-        if self.n_pixels_per_line == 0 and self.n_lines_per_roi == 0:
-            # assume we are in pointing mode in this case, probably better if this were passed as an argument?
-            # this class would need to know about the pointing mode then though.
-            self.n_pixels_per_line = 1
-            self.n_lines_per_roi = 1
+        # The shape of every ROI is worked out in one go, and stored by ROI index.
+        n_y_pixels = self.y_stop - self.y_start
+        n_x_pixels = self.x_stop - self.x_start
+        scans_along_x = self.angle == 0
+        self.n_lines_by_roi = np.where(scans_along_x, n_y_pixels, n_x_pixels)
+        self.n_pixels_per_line_by_roi = np.where(scans_along_x, n_x_pixels, n_y_pixels)
+        # assume we are in pointing mode if an ROI has no extent, probably better if this were passed as an
+        # argument? this class would need to know about the pointing mode then though.
+        pointing = (self.n_lines_by_roi == 0) & (self.n_pixels_per_line_by_roi == 0)
+        self.n_lines_by_roi[pointing] = 1
+        self.n_pixels_per_line_by_roi[pointing] = 1
+        self.n_lines_per_roi = int(self.n_lines_by_roi[0])
+        self.n_pixels_per_line = int(self.n_pixels_per_line_by_roi[0])
 
 
 class LabViewTimingsPre2018(LabViewTimings):
@@ -53,13 +86,12 @@ class LabViewTimingsPre2018(LabViewTimings):
 
     def _format_pixel_time_offsets(self):
         row_increments = np.arange(self.n_pixels_per_line) * self.dwell_time
-        pixel_time_offsets_by_roi = {}
-        for roi_index in np.arange(self.n_rois):
-            start_index = self.n_lines_per_roi * roi_index
-            end_index = start_index + self.n_lines_per_roi
-            row_offsets = self.pixel_time_offsets[start_index:end_index]
-            pixel_time_offsets_by_roi[roi_index] = row_offsets[:, np.newaxis] + row_increments
-        self.pixel_time_offsets = pixel_time_offsets_by_roi
+        # The file lists the start time of each line of each ROI in turn, so we compute the
+        # offsets for all ROIs at once, as an array indexed by [roi, line, pixel].
+        n_lines = self.n_rois * self.n_lines_per_roi
+        row_offsets = self.pixel_time_offsets.values[:n_lines].reshape(self.n_rois, self.n_lines_per_roi)
+        all_offsets = row_offsets[:, :, np.newaxis] + row_increments
+        self.pixel_time_offsets = {roi_index: all_offsets[roi_index] for roi_index in range(self.n_rois)}
 
 
 class LabViewTimings231(LabViewTimings):
@@ -69,31 +101,26 @@ class LabViewTimings231(LabViewTimings):
         self._format_pixel_time_offsets(n_cycles_per_trial, n_trials)
 
     def _read_relative_times_file(self, file_path):
-        raw_data = pd.read_csv(file_path, sep='\t', dtype=np.float64) / 1e6
-        self.pixel_time_offsets = raw_data['Image Time [us]']
+        # Only the image times are needed, so just that column is parsed and scaled
+        raw_data = pd.read_csv(file_path, sep='\t', usecols=['Image Time [us]'], dtype=np.float64,
+                               memory_map=True)
+        self.pixel_time_offsets = raw_data['Image Time [us]'] / 1e6
         self.pixel_time_offsets = self.pixel_time_offsets[self.pixel_time_offsets != 0]
 
     def _format_pixel_time_offsets(self, n_cycles_per_trial, n_trials):
-        pixel_time_offsets_by_roi = {}
+        n_cycles = n_cycles_per_trial * n_trials
         n_lines_per_cycle = self.n_rois * self.n_lines_per_roi
         row_increments = np.arange(self.n_pixels_per_line) * self.dwell_time
-        for roi_index in np.arange(0, self.n_rois):
-            pixel_time_offsets_by_roi[roi_index] = []
-            for cycle_index in np.arange(0, n_cycles_per_trial * n_trials):
-                start_index = self.n_lines_per_roi * roi_index + n_lines_per_cycle * cycle_index
-                end_index = start_index + self.n_lines_per_roi
-                pixel_time_offsets_by_roi[roi_index].append(self.pixel_time_offsets.values[start_index:end_index])
-            pixel_time_offsets_by_roi[roi_index] = np.reshape(pixel_time_offsets_by_roi[roi_index],
-                                                              (n_trials * n_cycles_per_trial, self.n_lines_per_roi))
-            pixel_time_offsets_by_roi[roi_index] = pixel_time_offsets_by_roi[roi_index][:, :, np.newaxis] + row_increments
+        # The file lists the start time of each line of each ROI in turn, for every cycle, so
+        # we can view the times as an array indexed by [cycle, roi, line] and pick out each
+        # ROI's lines for all cycles at once, rather than slicing out one cycle at a time.
+        row_offsets = self.pixel_time_offsets.values[:n_cycles * n_lines_per_cycle].reshape(
+            n_cycles, self.n_rois, self.n_lines_per_roi)
+        pixel_time_offsets_by_roi = {roi_index: row_offsets[:, roi_index, :, np.newaxis] + row_increments
+                                     for roi_index in range(self.n_rois)}
 
         # estimate time for one cycle by averaging the time it takes for the first cycle of each trial.
         # The n_pixels_per_line * pixel_dwell_time contribution of the last line is negligible.
-        first_cycle_times_for_each_trial = []
-        for trial_index in list(range(n_trials)):
-            first_cycle_times_for_each_trial.append(pixel_time_offsets_by_roi[self.n_rois - 1]
-                                                    [trial_index * n_cycles_per_trial]
-                                                    [self.n_lines_per_roi - 1][0])
-
+        first_cycle_times_for_each_trial = row_offsets[::n_cycles_per_trial, -1, -1]
         self.cycle_time = np.mean(first_cycle_times_for_each_trial)
         self.pixel_time_offsets = pixel_time_offsets_by_roi
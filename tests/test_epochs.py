@@ -5,9 +5,10 @@ import os
 import h5py
 import numpy as np
 import pandas as pd
+from hdmf.backends.hdf5 import H5DataIO
 from ruamel.yaml import YAML
 
-from silverlabnwb import NwbFile
+from silverlabnwb import NwbFile, nwb_file
 from silverlabnwb.nwb_file import LabViewVersions
 
 ignored = ['labview_header']
@@ -189,3 +190,48 @@ def test_epochs(tmpdir, capfd, ref_data_dir):
         nwb.add_speed_data(speed_data, start_time)
         nwb.determine_trial_times()
     compare_hdf5(nwb_path, os.path.join(ref_data_dir, 'expected_epochs.yaml'))
+
+
+def test_epochs_compressed(tmpdir, ref_data_dir, monkeypatch):
+    """Trials are found the same way when the speed data is stored compressed."""
+    # The test speed data is too small to be compressed otherwise
+    monkeypatch.setattr(nwb_file, 'COMPRESS_THRESHOLD', 0)
+    nwb_path = os.path.join(str(tmpdir), "test_epochs_compressed.nwb")
+    with NwbFile(nwb_path, mode='w') as nwb:
+        speed_data, start_time = nwb.create_nwb_file(ref_data_dir, 'test_epochs')
+        nwb.compress = True
+        nwb.add_core_metadata()
+        nwb.add_speed_data(speed_data, start_time)
+        assert isinstance(nwb.nwb_file.get_acquisition('trial_times').data, H5DataIO)
+        nwb.determine_trial_times()
+    compare_hdf5(nwb_path, os.path.join(ref_data_dir, 'expected_epochs.yaml'))
+    with h5py.File(nwb_path, 'r') as hdf_file:
+        assert hdf_file['/acquisition/trial_times/data'].compression is not None
+
+
+def test_epoch_and_trial_tables(tmpdir, ref_data_dir):
+    """The epoch and trial tables built in one go match adding each trial in turn."""
+    nwb_path = os.path.join(str(tmpdir), "test_epoch_tables.nwb")
+    with NwbFile(nwb_path, mode='w') as nwb:
+        speed_data, start_time = nwb.create_nwb_file(ref_data_dir, 'test_epochs')
+        nwb.add_core_metadata()
+        nwb.add_speed_data(speed_data, start_time)
+        nwb.determine_trial_times()
+        speed_data_ts = nwb.nwb_file.get_acquisition('speed_data')
+        speed_times = nwb.get_times(speed_data_ts)
+        epochs, trials = nwb.nwb_file.epochs, nwb.nwb_file.trials
+        num_trials = len(epochs)
+        assert num_trials > 0
+        assert len(trials) == num_trials
+        for i in range(num_trials):
+            epoch_start = epochs['start_time'][i]
+            epoch_stop = epochs['stop_time'][i]
+            assert epochs['epoch_name'][i] == 'trial_{:04d}'.format(i + 1)
+            # Only the first epoch starts exactly at its trial's start
+            assert epoch_start == trials['start_time'][i] + (1e-9 if i > 0 else 0)
+            assert epoch_stop == trials['stop_time'][i] + 1e-9
+            # Each epoch refers to the speed readings from its start up to its stop
+            idx_start, count, timeseries = epochs['timeseries'][i][0]
+            in_epoch = np.flatnonzero((speed_times >= epoch_start) & (speed_times < epoch_stop))
+            assert timeseries is speed_data_ts
+            assert (idx_start, count) == (in_epoch[0], in_epoch.size)
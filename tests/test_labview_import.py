@@ -2,9 +2,12 @@
 import os
 
 import h5py
+import numpy as np
 import pytest
+from pynwb.image import ImageSeries
 
 from silverlabnwb import NwbFile
+from silverlabnwb.imaging import Modes
 from silverlabnwb.signature import SignatureGenerator
 
 # Where to look for large raw data files
@@ -121,6 +124,42 @@ class TestFullImporting(object):
         do_import_test('170322_14_06_43', True)
 
 
+def test_add_rois(tmpdir, ref_data_dir):
+    """Check the ROI tables built from a synthetic ROI.dat, which needs no raw data."""
+    nwb_path = os.path.join(str(tmpdir), 'test_rois.nwb')
+    with NwbFile(nwb_path, mode='w') as nwb:
+        nwb.create_nwb_file(ref_data_dir, 'test_rois')
+        nwb.add_core_metadata()
+        nwb.experiment['optophysiology'] = {
+            'excitation_lambda': 920, 'emission_lambda': {'green': 510, 'red': 580},
+            'calcium_indicator': 'Test indicator', 'location': 'Test location'}
+        nwb.mode = Modes.miniscan
+        nwb.cycle_time = 1e-3
+        # The synthetic file has one ROI in each of 4 planes, at Z = 0 to 3
+        nwb.zplanes, nwb.zstack = {}, {}
+        for z in range(4):
+            plane_name = 'Zstack{:04d}'.format(z + 1)
+            nwb.zplanes[z] = plane_name
+            nwb.add_imaging_plane(plane_name, 'Reference Z stack', [0, 0, z], [1, 1, 0])
+            nwb.zstack[plane_name] = {'Red': 'Zstack_Red_{:04d}'.format(z + 1)}
+            nwb.add_time_series_data(nwb.zstack[plane_name]['Red'], data=np.zeros((1, 4, 4)),
+                                     times=np.array([0.0]), kind=ImageSeries, data_attrs={'unit': 'intensity'})
+        nwb.add_rois(os.path.join(ref_data_dir, 'synthetic v231 ROI.dat'))
+        planes = nwb.nwb_file.processing['Acquired_ROIs'].get('ImageSegmentation').plane_segmentations
+        assert sorted(planes) == sorted(nwb.zplanes.values())
+        for z, plane_name in nwb.zplanes.items():
+            plane = planes[plane_name]
+            assert nwb.roi_mapping[plane_name] == {z + 1: 0}
+            # Each ROI is 6 pixels along X by 5 along Y, starting at (70 + 10z, 100 + 100z)
+            x_start, y_start = 70 + 10 * z, 100 + 100 * z
+            assert plane['x_start'][0] == x_start
+            assert plane['y_stop'][0] == y_start + 5
+            assert plane['num_pixels'][0] == 30
+            np.testing.assert_array_equal(plane['dimensions'][0], [6, 5])
+            expected_mask = [[x, y, 1] for y in range(y_start, y_start + 5) for x in range(x_start, x_start + 6)]
+            np.testing.assert_array_equal(plane['pixel_mask'][0], expected_mask)
+
+
 @pytest.mark.skipif(
     not os.path.isdir(DATA_PATH),
     reason="raw data folder '{}' not present".format(DATA_PATH))
@@ -46,3 +46,25 @@ def test_metadata_import_correct(tmpdir, ref_data_dir):
     if os.environ.get('SILVERLAB_GEN_REF', '0') != '0':
         sig_gen.save_sig(nwb_path, sig_path)
     assert sig_gen.compare_to_sig(nwb_path, sig_path)
+
+
+def test_metadata_saved_without_context_manager(tmpdir, ref_data_dir):
+    nwb_path = os.path.join(str(tmpdir), "metadata_only_B.nwb")
+    meta_path = os.path.join(ref_data_dir, 'meta_two_users.yaml')
+    sig_path = os.path.join(ref_data_dir, 'metadata_only_B.sig2')
+    nwb = NwbFile(nwb_path, 'w')
+    nwb.create_from_metadata(meta_path, user="B")
+    # The file on disk is complete before the object is closed
+    assert SignatureGenerator().compare_to_sig(nwb_path, sig_path)
+    nwb.close()
+
+
+def test_failed_batch_not_saved(tmpdir, ref_data_dir):
+    nwb_path = os.path.join(str(tmpdir), "metadata_only_B.nwb")
+    meta_path = os.path.join(ref_data_dir, 'meta_two_users.yaml')
+    with pytest.raises(RuntimeError, match="Stop"):
+        with NwbFile(nwb_path, 'w') as nwb:
+            with nwb._batch_writes():
+                nwb.create_from_metadata(meta_path, user="B")
+                raise RuntimeError("Stop")
+    assert not os.path.exists(nwb_path)
@@ -0,0 +1,54 @@
+"""Tests of the hashing used in NWB file signatures."""
+
+import re
+
+import h5py
+import numpy as np
+import pytest
+
+from silverlabnwb.signature import HASH_ALGORITHMS, SignatureGenerator
+
+
+@pytest.mark.parametrize("values", [
+    np.array(['2017-03-17T10:11:01', '2017-03-17T10:12:30'], dtype='datetime64[us]'),
+    np.array([1500, 250], dtype='timedelta64[ms]'),
+    np.arange(6, dtype='>i4').reshape(2, 3),
+    np.array([b'trial_0001', b'trial_0002']),
+])
+def test_array_hash_matches_bytes(values):
+    """Arrays of any simple type hash the same as their bytes."""
+    sig_gen = SignatureGenerator()
+    assert sig_gen.array_hash(values) == sig_gen.value_hash(values.tobytes())
+
+
+@pytest.mark.parametrize("hash_algorithm", sorted(HASH_ALGORITHMS))
+def test_dataset_hash_matches_array_hash(tmpdir, hash_algorithm):
+    """Hashing a dataset from the file gives the same result as hashing it in memory,
+    whatever its chunk layout."""
+    data = np.arange(3000, dtype=np.float32).reshape(1000, 3)
+    # ROI data is widened to double for hashing, but keeps its type in the signature
+    expected_hash = SignatureGenerator(hash_algorithm).array_hash(data.astype(np.float64))
+    expected_sig = '/acquisition/ROI_0001/data: dtype=float32 shape=(1000, 3) val="{}"'.format(expected_hash)
+    with h5py.File(str(tmpdir.join('test.h5')), 'w') as hdf_file:
+        for i, chunks in enumerate([None, (7, 3), (50, 3), (1000, 1)]):
+            dataset = hdf_file.create_dataset('/acquisition/ROI_{:04d}/data'.format(i + 1), data=data, chunks=chunks)
+            # Hashed in memory, as the dataset is small
+            sig_gen = SignatureGenerator(hash_algorithm)
+            in_memory_sig = sig_gen.dataset_sig(dataset)
+            # Hashed from the file, in several blocks not aligned with the dataset's rows
+            sig_gen.HASH_BLOCK_BYTES = 1000
+            assert sig_gen.dataset_hash(dataset, np.float64) == expected_hash
+            from_file_sig = sig_gen.dataset_sig(dataset)
+            for sig in [in_memory_sig, from_file_sig]:
+                assert sig.replace('ROI_{:04d}'.format(i + 1), 'ROI_0001').startswith(expected_sig)
+
+
+@pytest.mark.parametrize("pattern", [r'(a)?b(?(1)c|d)', r'(x)\1', r'(?P<x>y)(?P=x)', r'(?i)CASE'])
+@pytest.mark.parametrize("path", ['bc', 'bd', 'abc', 'abd', 'xx', 'yy', 'case', 'other'])
+def test_ignore_path_patterns_keep_their_meaning(pattern, path):
+    """Ignore patterns match the same paths however many others they are given with."""
+    sig_gen = SignatureGenerator()
+    for other in [r'(q)r', 'other', pattern]:
+        sig_gen.ignore_path(other)
+    expected = re.fullmatch(pattern, path) is not None or path == 'other'
+    assert sig_gen.ignored_path(path) == expected
@@ -1,5 +1,6 @@
 import os
 
+import numpy as np
 import pytest
 
 from silverlabnwb import timings
@@ -65,3 +66,56 @@ def test_pixel_time_offsets_for_roi_pre2018(synthetic_timings_pre2018, roi_index
     assert roi_offsets.shape == expected_shape
     assert roi_offsets[0][0] == expected_first_row_offset
     assert roi_offsets[-1][0] == expected_last_row_offset
+
+
+def test_read_roi_dat_accepts_whole_floats(tmpdir):
+    roi_path = os.path.join(str(tmpdir), "ROI.dat")
+    with open(roi_path, 'w') as roi_file:
+        roi_file.write("ROI index\tX start\tX stop\tAngle (deg)\n"
+                       "1\t70\t76.0\t0\n"
+                       "2\t80.0\t86\t\n")
+    roi_data = timings.read_roi_dat(roi_path, int_columns=['X start', 'X stop'])
+    assert roi_data['X start'].dtype == np.int64
+    assert roi_data['X start'].tolist() == [70, 80]
+    assert roi_data['X stop'].tolist() == [76, 86]
+    # Missing values are allowed in other columns
+    assert np.isnan(roi_data['Angle (deg)'][1])
+
+
+@pytest.mark.parametrize("bad_value", ["70.5", ""])
+def test_read_roi_dat_rejects_non_whole_coordinates(tmpdir, bad_value):
+    roi_path = os.path.join(str(tmpdir), "ROI.dat")
+    with open(roi_path, 'w') as roi_file:
+        roi_file.write("ROI index\tX start\tX stop\n"
+                       "1\t{}\t76\n".format(bad_value))
+    with pytest.raises(ValueError, match="X start"):
+        timings.read_roi_dat(roi_path, int_columns=['X start', 'X stop'])
+
+
+def test_pixel_time_offsets_with_float_coordinates_pre2018(ref_data_dir, tmpdir, synthetic_timings_pre2018):
+    """Coordinates written as e.g. 100.0 give the same timings as plain integers."""
+    with open(os.path.join(ref_data_dir, "synthetic pre2018 ROI.dat")) as roi_file:
+        rows = [line.rstrip('\n').split('\t') for line in roi_file]
+    coordinate_fields = [rows[0].index(column) for column in timings.LabViewTimings.roi_int_columns]
+    for row in rows[1:]:
+        for field in coordinate_fields:
+            row[field] += '.0'
+    roi_path = os.path.join(str(tmpdir), "ROI.dat")
+    with open(roi_path, 'w') as roi_file:
+        roi_file.writelines('\t'.join(row) + '\n' for row in rows)
+    float_timings = timings.LabViewTimingsPre2018(
+        relative_times_path=os.path.join(ref_data_dir, "synthetic pre2018 Single cycle relative times.txt"),
+        roi_path=roi_path,
+        dwell_time=1.e-6)
+    assert float_timings.n_lines_per_roi == synthetic_timings_pre2018.n_lines_per_roi
+    assert float_timings.n_pixels_per_line == synthetic_timings_pre2018.n_pixels_per_line
+    for roi_index, roi_offsets in synthetic_timings_pre2018.pixel_time_offsets.items():
+        np.testing.assert_array_equal(float_timings.pixel_time_offsets[roi_index], roi_offsets)
+
+
+def test_roi_shapes(synthetic_timings_v231, synthetic_timings_pre2018):
+    """The shape of every ROI is worked out when reading ROI.dat."""
+    np.testing.assert_array_equal(synthetic_timings_v231.n_lines_by_roi, [5] * 4)
+    np.testing.assert_array_equal(synthetic_timings_v231.n_pixels_per_line_by_roi, [6] * 4)
+    np.testing.assert_array_equal(synthetic_timings_pre2018.n_lines_by_roi, [4] * 2)
+    np.testing.assert_array_equal(synthetic_timings_pre2018.n_pixels_per_line_by_roi, [10] * 2)